@@ -0,0 +1,63 @@
+"""Compares the caption layout solver with the old shrink-by-2 loop.
+
+Run from the repository root:
+
+    python -m benchmarks.caption_layout
+"""
+import time
+
+from PIL import Image, ImageDraw
+
+from utils.image_utils import MIN_CAPTION_FONT_SIZE, _measure_caption, solve_caption_layout
+
+WIDTHS = [320, 800, 1920, 4000]
+SENTENCE = "when the caption is long enough that it needs several lines to fit"
+# Upper-case and wide-glyph captions overflow the average-width wrap estimate,
+# which is what forces the layout to try smaller sizes.
+CAPTIONS = [
+    (length, words.split())
+    for length in (10, 80, 300, 1000)
+    for words in (SENTENCE, SENTENCE.upper(), "WWWWWWWWWWWWWWWWWWWWWWWW MMMMMMMMMMMMM")
+]
+
+
+def legacy_layout_passes(text, image_width, multiplier=1.0):
+    """Counts the measuring passes the old decrement-by-2 loop needed."""
+    padding = int(image_width * 0.04)
+    drawable_width = image_width - (2 * padding)
+    draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    font_size = int((image_width / 10) * multiplier)
+    passes = 0
+    while font_size > MIN_CAPTION_FONT_SIZE:
+        passes += 1
+        result = _measure_caption(draw, text, font_size, drawable_width)
+        if result is not None and result[1][2] - result[1][0] <= drawable_width:
+            break
+        font_size -= 2
+    return passes
+
+
+def main():
+    print(f"{'width':>6} {'chars':>6} {'text':>12} {'legacy passes':>14} {'bisect passes':>14} {'legacy ms':>10} {'bisect ms':>10} {'size':>5}")
+    for width in WIDTHS:
+        for length, words in CAPTIONS:
+            text = ""
+            i = 0
+            while len(text) < length:
+                text += words[i % len(words)] + " "
+                i += 1
+            text = text[:length].strip()
+
+            start = time.perf_counter()
+            legacy_passes = legacy_layout_passes(text, width)
+            legacy_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            layout = solve_caption_layout(text, width)
+            bisect_ms = (time.perf_counter() - start) * 1000
+
+            print(f"{width:>6} {length:>6} {text[:12]:>12} {legacy_passes:>14} {layout.probes:>14} {legacy_ms:>10.2f} {bisect_ms:>10.2f} {layout.font_size:>5}")
+
+
+if __name__ == "__main__":
+    main()
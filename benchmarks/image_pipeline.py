@@ -0,0 +1,222 @@
+"""Benchmarks add_caption_to_image and convert_to_gif on synthetic inputs.
+
+Every case runs in a fresh process so peak RSS is measured per operation.
+Results are written as JSON, which a later run can be compared against.
+Run from the repository root:
+
+    python -m benchmarks.image_pipeline --output before.json
+    python -m benchmarks.image_pipeline --compare before.json
+    python -m benchmarks.image_pipeline --quick
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import PIL
+from PIL import Image, ImageDraw
+
+from utils.image_utils import add_caption_to_image, convert_to_gif
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STATIC_SIZES = [320, 1024, 2048, 4000]
+GIF_SIZES = [240, 480]
+GIF_FRAME_COUNTS = [10, 60, 200]
+CAPTION_LENGTHS = [10, 80, 300]
+MAX_GIF_SIZE = 5 * 1024 * 1024
+CAPTION_WORDS = "when the caption is long enough that it needs several lines to fit".split()
+
+QUICK_STATIC_SIZES = [320, 2048]
+QUICK_GIF_SIZES = [240]
+QUICK_GIF_FRAME_COUNTS = [10, 60]
+QUICK_CAPTION_LENGTHS = [80]
+
+
+# --- Synthetic Corpus ---
+
+def make_caption(length):
+    text = ""
+    i = 0
+    while len(text) < length:
+        text += CAPTION_WORDS[i % len(CAPTION_WORDS)] + " "
+        i += 1
+    return text[:length].strip()
+
+def make_photo(width, height):
+    """A photo-like RGB image: smooth gradients with sensor-style noise, so it compresses like a real photo."""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    radial = Image.radial_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 24)
+    return Image.merge('RGB', (gradient, Image.blend(radial, noise, 0.3), noise))
+
+def make_static(fmt, side):
+    img = make_photo(side, side * 3 // 4)
+    output = io.BytesIO()
+    if fmt == 'JPEG':
+        img.save(output, format='JPEG', quality=90)
+    else:
+        img.save(output, format='PNG')
+    return output.getvalue()
+
+def make_gif(side, frame_count):
+    """An animated GIF of a ball moving over a photo-like background."""
+    background = make_photo(side, side)
+    frames = []
+    radius = side // 8
+    for i in range(frame_count):
+        frame = background.copy()
+        x = int((side - 2 * radius) * i / max(frame_count - 1, 1))
+        ImageDraw.Draw(frame).ellipse((x, side // 2 - radius, x + 2 * radius, side // 2 + radius), fill=(220, 40, 40))
+        frames.append(frame.quantize(colors=128))
+    output = io.BytesIO()
+    frames[0].save(output, format='GIF', save_all=True, append_images=frames[1:], duration=50, loop=0)
+    return output.getvalue()
+
+def build_corpus(quick=False):
+    """Returns a list of (case_id, operation, input_info, data, params)."""
+    static_sizes = QUICK_STATIC_SIZES if quick else STATIC_SIZES
+    gif_sizes = QUICK_GIF_SIZES if quick else GIF_SIZES
+    frame_counts = QUICK_GIF_FRAME_COUNTS if quick else GIF_FRAME_COUNTS
+    caption_lengths = QUICK_CAPTION_LENGTHS if quick else CAPTION_LENGTHS
+
+    inputs = []
+    for fmt in ('PNG', 'JPEG'):
+        for side in static_sizes:
+            inputs.append((f"{fmt.lower()}-{side}", {"format": fmt, "width": side, "height": side * 3 // 4, "frames": 1}, make_static(fmt, side)))
+    for side in gif_sizes:
+        for frame_count in frame_counts:
+            inputs.append((f"gif-{side}x{frame_count}", {"format": "GIF", "width": side, "height": side, "frames": frame_count}, make_gif(side, frame_count)))
+
+    cases = []
+    for name, info, data in inputs:
+        animated = info["frames"] > 1
+        for length in caption_lengths:
+            cases.append((f"caption/{name}/{length}", "caption", info, data, {"text": make_caption(length), "animated": animated}))
+        cases.append((f"togif/{name}", "togif", info, data, {"max_size": MAX_GIF_SIZE}))
+    return cases
+
+
+# --- Measurement ---
+
+def _max_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss  # macOS reports bytes
+
+def run_case(operation, data, params, repeat):
+    """Runs one case in the current (fresh) process. Returns its measurements."""
+    baseline_kb = _max_rss_kb()
+    timings = []
+    output = None
+    extra = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if operation == "caption":
+            output = add_caption_to_image(data, params["text"], params["animated"])
+        else:
+            output, error, tradeoffs = convert_to_gif(data, params["max_size"])
+            extra = {"error": error, "tradeoffs": tradeoffs}
+        timings.append((time.perf_counter() - start) * 1000)
+    peak_kb = _max_rss_kb()
+    return {
+        "wall_ms": statistics.median(timings),
+        "wall_ms_min": min(timings),
+        "peak_rss_kb": peak_kb,
+        "rss_growth_kb": None if peak_kb is None else peak_kb - baseline_kb,
+        "output_bytes": len(output) if output else 0,
+        **extra,
+    }
+
+def run_suite(cases, repeat):
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for case_id, operation, info, data, params in cases:
+        # A new process per case keeps one case's peak RSS out of the next.
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            measured = pool.submit(run_case, operation, data, params, repeat).result()
+        result = {"case": case_id, "operation": operation, **info, "input_bytes": len(data), **measured}
+        if operation == "caption":
+            result["caption_chars"] = len(params["text"])
+        results.append(result)
+        print(f"{case_id:<28} {measured['wall_ms']:>10.1f} ms {_format_kb(measured['peak_rss_kb']):>10} {measured['output_bytes']:>12,} B", file=sys.stderr)
+    return results
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "cpu_count": multiprocessing.cpu_count(),
+    }
+
+
+# --- Reporting ---
+
+def _format_kb(kb):
+    return "n/a" if kb is None else f"{kb / 1024:.1f} MB"
+
+def _change(old, new):
+    if not old or new is None:
+        return "n/a"
+    return f"{(new - old) / old:+.0%}"
+
+def compare(baseline, report):
+    """Prints per-case changes between a baseline report and this one."""
+    before = {r["case"]: r for r in baseline["results"]}
+    print(f"Baseline: {baseline['environment'].get('commit')}  Current: {report['environment'].get('commit')}")
+    print(f"{'case':<28} {'wall ms':>20} {'change':>7} {'peak RSS':>22} {'change':>7} {'output':>7}")
+    for result in report["results"]:
+        old = before.get(result["case"])
+        if old is None:
+            print(f"{result['case']:<28} (new case)")
+            continue
+        print(
+            f"{result['case']:<28} {old['wall_ms']:>9.1f} -> {result['wall_ms']:>7.1f} {_change(old['wall_ms'], result['wall_ms']):>7} "
+            f"{_format_kb(old['peak_rss_kb']):>10} -> {_format_kb(result['peak_rss_kb']):>9} {_change(old['peak_rss_kb'], result['peak_rss_kb']):>7} "
+            f"{_change(old['output_bytes'], result['output_bytes']):>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help="run a small subset of the cases")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case; the median wall time is reported")
+    parser.add_argument('--filter', default='', help="only run cases whose id contains this text")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    parser.add_argument('--compare', help="a previous JSON report to compare against")
+    args = parser.parse_args()
+
+    cases = [case for case in build_corpus(args.quick) if args.filter in case[0]]
+    report = {"environment": environment(), "repeat": args.repeat, "results": run_suite(cases, args.repeat)}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
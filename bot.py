@@ -2,8 +2,12 @@ import discord
 from discord.ext import commands
 import term
 from encryption import generate_key, encrypt_file, decrypt_file
+from utils.storage import Storage, WriteBehindFlusher
+from utils.image_engine import ImageEngine
+from utils.media import MediaFetcher
+from utils.http import HttpClient
+from utils.upstream import UpstreamPolicies
 import os
-import json
 import configparser
 import asyncio
 import threading
@@ -74,26 +78,36 @@ async def start_bot():
         logging.error("Error: DISCORD_TOKEN not found or is empty in .env file.")
         return
 
-    # --- Settings Management ---
-    try:
-        with open("servers/settings.json", "r") as f:
-            bot_settings = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        bot_settings = {}
-
-    def save_settings():
-        os.makedirs("servers", exist_ok=True)
-        with open("servers/settings.json", "w") as f:
-            json.dump(bot.settings, f, indent=4)
-
     bot_config = configparser.ConfigParser()
     if not os.path.exists("bot-settings.ini"):
         bot_config['togif'] = {'max_gif_size_mb': '5'}
         bot_config['ai'] = {'features_enabled': 'false', 'huggingface_token': 'YOUR_TOKEN_HERE'}
+        bot_config['storage'] = {'settings_flush_seconds': '2', 'journal_compact_seconds': '300'}
+        bot_config['image'] = {'workers': '2', 'max_queue': '8', 'job_timeout_seconds': '60', 'recycle_after_jobs': '200', 'cache_memory_mb': '64', 'cache_disk_mb': '512', 'cache_dir': 'servers/cache/images', 'max_output_side': '2048'}
+        bot_config['http'] = {'max_connections': '100', 'max_connections_per_host': '10', 'keepalive_seconds': '30', 'dns_cache_seconds': '300', 'timeout_seconds': '15', 'connect_timeout_seconds': '5'}
+        bot_config['upstream'] = {'max_retries': '1', 'max_wait': '10', 'failure_threshold': '5', 'reset_seconds': '30'}
+        bot_config['response_cache'] = {'memory_mb': '8', 'persistent': 'true', 'default_ttl_seconds': '3600', 'negative_ttl_seconds': '600'}
+        bot_config['media'] = {'max_download_mb': '25', 'max_pixels': '40000000', 'max_frames': '500', 'download_timeout_seconds': '30'}
         with open('bot-settings.ini', 'w') as configfile:
             bot_config.write(configfile)
     bot_config.read("bot-settings.ini")
 
+    # --- Settings Management ---
+    storage = Storage()
+    await storage.open()
+    bot_settings = await storage.load_settings()
+
+    async def flush_settings(guild_ids):
+        await storage.save_guild_settings({gid: bot.settings.get(gid, {}) for gid in guild_ids})
+
+    settings_flusher = WriteBehindFlusher(
+        flush_settings,
+        delay=bot_config.getfloat('storage', 'settings_flush_seconds', fallback=2.0)
+    )
+
+    def save_settings(guild_id):
+        settings_flusher.mark_dirty(str(guild_id))
+
     try:
         max_gif_size = bot_config.getint('togif', 'max_gif_size_mb', fallback=5) * 1024 * 1024
         ai_enabled = bot_config.getboolean('ai', 'features_enabled', fallback=False)
@@ -105,6 +119,35 @@ async def start_bot():
         hf_token = ''
         tmdb_api_key = ''
 
+    image_engine = ImageEngine(
+        workers=bot_config.getint('image', 'workers', fallback=2),
+        max_queue=bot_config.getint('image', 'max_queue', fallback=8),
+        job_timeout=bot_config.getfloat('image', 'job_timeout_seconds', fallback=60.0),
+        recycle_after=bot_config.getint('image', 'recycle_after_jobs', fallback=200)
+    )
+    # [upstream] sets defaults for every host; [upstream:<host>] sections override one host.
+    upstream_policies = UpstreamPolicies(
+        defaults=dict(bot_config['upstream']) if bot_config.has_section('upstream') else None,
+        overrides={name.split(':', 1)[1]: dict(bot_config[name]) for name in bot_config.sections() if name.startswith('upstream:')}
+    )
+    http_client = HttpClient(
+        limit=bot_config.getint('http', 'max_connections', fallback=100),
+        limit_per_host=bot_config.getint('http', 'max_connections_per_host', fallback=10),
+        keepalive_timeout=bot_config.getfloat('http', 'keepalive_seconds', fallback=30.0),
+        dns_cache_seconds=bot_config.getint('http', 'dns_cache_seconds', fallback=300),
+        timeout=bot_config.getfloat('http', 'timeout_seconds', fallback=15.0),
+        connect_timeout=bot_config.getfloat('http', 'connect_timeout_seconds', fallback=5.0),
+        policies=upstream_policies
+    )
+    await http_client.open()
+    media = MediaFetcher(
+        http_client,
+        max_bytes=bot_config.getint('media', 'max_download_mb', fallback=25) * 1024 * 1024,
+        max_pixels=bot_config.getint('media', 'max_pixels', fallback=40_000_000),
+        max_frames=bot_config.getint('media', 'max_frames', fallback=500),
+        timeout=bot_config.getfloat('media', 'download_timeout_seconds', fallback=30.0)
+    )
+
     # --- Bot Definition ---
     DEFAULT_PREFIX = "?"
     def get_prefix(bot, message):
@@ -118,9 +161,13 @@ async def start_bot():
     intents.members = True
     bot = commands.Bot(command_prefix=get_prefix, intents=intents)
 
+    bot.storage = storage
     bot.settings = bot_settings
     bot.save_settings = save_settings
     bot.max_gif_size = max_gif_size
+    bot.image_engine = image_engine
+    bot.http_client = http_client
+    bot.media = media
     bot.hf_token = hf_token
     bot.tmdb_api_key = tmdb_api_key
 
@@ -173,7 +220,16 @@ async def start_bot():
         logging.info("Cogs loaded. Bot is ready.")
 
     logging.info("Starting bot...")
-    await bot.start(config["DISCORD_TOKEN"])
+    try:
+        await bot.start(config["DISCORD_TOKEN"])
+    finally:
+        # Closing the bot unloads every cog, giving them a chance to flush.
+        if not bot.is_closed():
+            await bot.close()
+        await settings_flusher.close()
+        await storage.close()
+        await http_client.close()
+        image_engine.close()
 
 # --- Main Menu ---
 def main():
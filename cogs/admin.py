@@ -32,7 +32,7 @@ class Admin(commands.Cog):
         if guild_id not in self.bot.settings:
             self.bot.settings[guild_id] = {}
         self.bot.settings[guild_id]["prefix"] = prefix
-        self.bot.save_settings()
+        self.bot.save_settings(guild_id)
         await ctx.send(f"Prefix for this server has been set to `{prefix}`")
 
     @setprefix.error
@@ -64,7 +64,7 @@ class Admin(commands.Cog):
         if guild_id not in self.bot.settings:
             self.bot.settings[guild_id] = {}
         self.bot.settings[guild_id]["welcome_message"] = message.content
-        self.bot.save_settings()
+        self.bot.save_settings(guild_id)
         await ctx.send("Welcome message has been set.")
 
     @welcome.command()
@@ -75,7 +75,7 @@ class Admin(commands.Cog):
         if guild_id not in self.bot.settings:
             self.bot.settings[guild_id] = {}
         self.bot.settings[guild_id]["welcome_channel_id"] = channel.id
-        self.bot.save_settings()
+        self.bot.save_settings(guild_id)
         await ctx.send(f"Welcome channel has been set to {channel.mention}")
 
     @welcome.command()
@@ -1,24 +1,37 @@
 import discord
 from discord.ext import commands
 import logging
-import aiohttp
 import typing
+import json
+import asyncio
+import aiohttp
+
+from utils.singleflight import SingleFlight
 
 class AI(commands.Cog):
     """AI-powered commands, such as text summarization."""
     def __init__(self, bot):
         self.bot = bot
         self.summary_api_url = "https://api-inference.huggingface.co/models/sshleifer/distilbart-cnn-12-6"
- 
+        self.requests = SingleFlight()
+
     async def query_api(self, payload, url):
+        # Summaries of the same messages requested at the same time share one inference call.
+        key = (url, json.dumps(payload, sort_keys=True))
+        return await self.requests.run(key, self._post_query, payload, url)
+
+    async def _post_query(self, payload, url):
         headers = {"Authorization": f"Bearer {self.bot.hf_token}"}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as response:
+        try:
+            async with self.bot.http_client.post(url, headers=headers, json=payload) as response:
                 if response.status == 200:
                     return await response.json()
                 else:
                     logging.error(f"Hugging Face API Error: {response.status} - {await response.text()}")
                     return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Hugging Face API request failed: {e}")
+            return None
 
     async def query_summary_api(self, text):
         payload = {
@@ -1,13 +1,20 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import aiohttp
 import asyncio
 import random
 import html
 import os
-import json
+import logging
+import configparser
 from datetime import datetime, timedelta
 
+from utils.ranking import LeaderboardIndex
+from utils.singleflight import SingleFlight
+from utils.trivia import TriviaBuffer
+
+GAMES = ("trivia", "hangman")
+
 class Games(commands.Cog):
     """Commands for playing games and checking ranks."""
     def __init__(self, bot):
@@ -15,8 +22,39 @@ class Games(commands.Cog):
         self.hangman_games = {}  # {channel_id: game_state}
         self.story_games = {}  # {channel_id: story_state}
         self.words = self._load_words()
-        self.leaderboard_file = "servers/leaderboard.json"
-        self.leaderboard = self._load_leaderboard()
+        self.leaderboard = {}
+        self.leaderboard_index = LeaderboardIndex()
+        self.requests = SingleFlight()
+        config = configparser.ConfigParser()
+        config.read('bot-settings.ini')
+        self.compact_interval = config.getfloat('storage', 'journal_compact_seconds', fallback=300.0)
+        self.trivia_questions = TriviaBuffer(
+            self._fetch_json,
+            batch_size=config.getint('trivia', 'batch_size', fallback=20),
+            low_water=config.getint('trivia', 'low_water', fallback=5)
+        )
+
+    async def cog_load(self):
+        self.leaderboard = await self.bot.storage.load_leaderboard()
+        self.leaderboard_index = LeaderboardIndex.from_leaderboard(self.leaderboard, GAMES)
+        self.compact_journal.change_interval(seconds=self.compact_interval)
+        self.compact_journal.start()
+        # Warm the any-category queue so the first round doesn't wait on OpenTDB.
+        self.trivia_questions.prefetch()
+
+    async def cog_unload(self):
+        self.compact_journal.cancel()
+        self.trivia_questions.close()
+
+    @tasks.loop(seconds=300)
+    async def compact_journal(self):
+        """Periodically rolls the score journal into the leaderboard snapshot."""
+        try:
+            compacted = await self.bot.storage.compact_journal()
+            if compacted:
+                logging.info(f"Compacted {compacted} score journal record(s).")
+        except Exception as e:
+            logging.error(f"Score journal compaction failed: {e}")
 
     # --- Data Loading --- #
     def _load_words(self):
@@ -27,22 +65,8 @@ class Games(commands.Cog):
             words = [line.strip().lower() for line in f if line.strip() and len(line.strip()) > 3 and line.strip().isalpha()]
         return words if words else ["python", "discord", "bot"]
 
-    def _load_leaderboard(self):
-        if os.path.exists(self.leaderboard_file):
-            with open(self.leaderboard_file, 'r') as f:
-                try:
-                    return json.load(f)
-                except json.JSONDecodeError:
-                    return {}
-        return {}
-
-    def _save_leaderboard(self):
-        os.makedirs("servers", exist_ok=True)
-        with open(self.leaderboard_file, 'w') as f:
-            json.dump(self.leaderboard, f, indent=4)
-
     # --- Score Handling --- #
-    def _update_score(self, guild_id, user_id, game: str):
+    async def _update_score(self, guild_id, user_id, game: str):
         gid = str(guild_id)
         uid = str(user_id)
         
@@ -55,33 +79,39 @@ class Games(commands.Cog):
             self.leaderboard[gid][uid]["trivia_wins"] += 1
         elif game == "hangman":
             self.leaderboard[gid][uid]["hangman_wins"] += 1
-            
-        self._save_leaderboard()
+
+        for g in GAMES:
+            self.leaderboard_index.update(gid, uid, g, self.leaderboard[gid][uid][f"{g}_wins"])
+        await self.bot.storage.add_win(gid, uid, game)
 
     # --- Trivia --- #
     async def _fetch_json(self, url):
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url) as response:
+        # Concurrent fetches of the same URL (e.g. several channels starting trivia at once) share one request.
+        return await self.requests.run(url, self._fetch_json_uncached, url)
+
+    async def _fetch_json_uncached(self, url):
+        try:
+            async with self.bot.http_client.get(url) as response:
+                # OpenTDB answers rate-limited calls with 429 and response_code 5 in the body.
+                if response.status != 429:
                     response.raise_for_status()
-                    return await response.json()
-            except aiohttp.ClientError as e:
-                print(f"API request failed for {url}: {e}")
-                return None
+                return await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"[Trivia] API request failed for {url}: {e}")
+            return None
 
     @commands.group(invoke_without_command=True)
     async def trivia(self, ctx, category_id: int = None):
         """Starts a trivia game. Optionally specify a category ID."""
-        api_url = "https://opentdb.com/api.php?amount=1&type=multiple"
-        if category_id:
-            api_url += f"&category={category_id}"
+        if category_id and not self.trivia_questions.is_known_category(category_id):
+            await ctx.send("That isn't a trivia category. Use `?trivia categories` to see them.")
+            return
 
-        data = await self._fetch_json(api_url)
-        if not data or not data.get("results"):
+        question_data = await self.trivia_questions.get_question(category_id or None)
+        if question_data is None:
             await ctx.send("Could not fetch a trivia question. Please try again later.")
             return
 
-        question_data = data["results"][0]
         question = html.unescape(question_data["question"])
         correct_answer = html.unescape(question_data["correct_answer"])
         options = [html.unescape(o) for o in question_data["incorrect_answers"]]
@@ -105,7 +135,7 @@ class Games(commands.Cog):
             user_answer = options[int(msg.content) - 1]
 
             if user_answer == correct_answer:
-                self._update_score(ctx.guild.id, ctx.author.id, "trivia")
+                await self._update_score(ctx.guild.id, ctx.author.id, "trivia")
                 await game_message.reply(f"Correct! 🎉 The answer was **{correct_answer}**.")
             else:
                 await game_message.reply(f"Sorry, that's incorrect. The correct answer was **{correct_answer}**.")
@@ -163,7 +193,7 @@ class Games(commands.Cog):
 
         # Check for win/loss
         if "".join(game['display']) == game['word']:
-            self._update_score(ctx.guild.id, ctx.author.id, "hangman")
+            await self._update_score(ctx.guild.id, ctx.author.id, "hangman")
             await ctx.send(f"Congratulations! You guessed the word: **{game['word']}**")
             del self.hangman_games[channel_id]
         elif game['wrong_guesses'] >= 6:
@@ -174,7 +204,7 @@ class Games(commands.Cog):
     @commands.command(name="leaderboard", aliases=["lb"])
     async def leaderboard_cmd(self, ctx, game: str = None):
         """Shows the server leaderboard for a game. Usage: ?lb <trivia|hangman>"""
-        if game not in ["trivia", "hangman"]:
+        if game not in GAMES:
             await ctx.send("Please specify a game for the leaderboard: `trivia` or `hangman`.")
             return
 
@@ -183,26 +213,18 @@ class Games(commands.Cog):
             await ctx.send("There are no scores on the leaderboard for this server yet.")
             return
 
-        key = f"{game}_wins"
-        
-        # Sort users by score for the specified game
-        sorted_users = sorted(
-            self.leaderboard[gid].items(), 
-            key=lambda item: item[1].get(key, 0), 
-            reverse=True
-        )
+        top_users = self.leaderboard_index.top(gid, game, 10)
 
         embed = discord.Embed(title=f"🏆 Leaderboard for {game.capitalize()}", color=discord.Color.gold())
         
         description = ""
-        for i, (uid, scores) in enumerate(sorted_users[:10]):
+        for i, (uid, score) in enumerate(top_users):
             try:
                 user = await self.bot.fetch_user(int(uid))
                 user_name = user.name
             except discord.NotFound:
                 user_name = f"User ID: {uid}"
             
-            score = scores.get(key, 0)
             rank_emoji = ["🥇", "🥈", "🥉"][i] if i < 3 else f"**#{i+1}**"
             description += f"{rank_emoji} {user_name} - {score} wins\n"
 
@@ -228,16 +250,24 @@ class Games(commands.Cog):
 
         embed = discord.Embed(title=f"Game Stats for {target_user.display_name}", color=target_user.color)
         embed.set_thumbnail(url=target_user.display_avatar.url)
-        embed.add_field(name="🧠 Trivia Wins", value=user_scores.get("trivia_wins", 0), inline=False)
-        embed.add_field(name="🪢 Hangman Wins", value=user_scores.get("hangman_wins", 0), inline=False)
+        embed.add_field(name="🧠 Trivia Wins", value=self._format_rank(gid, uid, "trivia", user_scores), inline=False)
+        embed.add_field(name="🪢 Hangman Wins", value=self._format_rank(gid, uid, "hangman", user_scores), inline=False)
 
         await ctx.send(embed=embed)
 
+    def _format_rank(self, gid, uid, game, user_scores):
+        wins = user_scores.get(f"{game}_wins", 0)
+        placement = self.leaderboard_index.rank(gid, game, uid)
+        if not placement:
+            return str(wins)
+        rank, total = placement
+        return f"{wins} (Rank #{rank} of {total})"
+
     @trivia.command(name="categories")
     async def trivia_categories(self, ctx):
         """Lists all available trivia categories."""
-        data = await self._fetch_json("https://opentdb.com/api_category.php")
-        if not data or not data.get("trivia_categories"):
+        categories = await self.trivia_questions.get_categories()
+        if not categories:
             await ctx.send("Could not fetch trivia categories.")
             return
 
@@ -247,7 +277,7 @@ class Games(commands.Cog):
         )
         
         description = ""
-        for cat in data["trivia_categories"]:
+        for cat in categories:
             description += f"**{cat['id']}**: {cat['name']}\n"
         
         embed.description = description
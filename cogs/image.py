@@ -3,16 +3,49 @@ from discord.ext import commands
 import typing
 import asyncio
 import io
-import aiohttp
 import logging
-from PIL import Image
+import configparser
 
 from utils.image_utils import add_caption_to_image, convert_to_gif
+from utils.image_engine import QueueFullError
+from utils.media import MediaError, MediaResolver, sized_variant_url
+from utils.result_cache import ResultCache, make_key
+
+def _format_tradeoffs(tradeoffs):
+    """Returns a note on what convert_to_gif reduced to fit the size limit, or None."""
+    if not tradeoffs:
+        return None
+    return f"Shrunk to fit the size limit: {', '.join(tradeoffs)}."
 
 class ImageCog(commands.Cog, name="Image"):
     """Commands for image manipulation."""
     def __init__(self, bot):
         self.bot = bot
+        config = configparser.ConfigParser()
+        config.read('bot-settings.ini')
+        self.result_cache = ResultCache(
+            memory_bytes=config.getint('image', 'cache_memory_mb', fallback=64) * 1024 * 1024,
+            disk_dir=config.get('image', 'cache_dir', fallback='servers/cache/images'),
+            disk_bytes=config.getint('image', 'cache_disk_mb', fallback=512) * 1024 * 1024
+        )
+        self.max_output_side = config.getint('image', 'max_output_side', fallback=2048)
+        self.resolver = MediaResolver()
+
+    def _source_url(self, source):
+        """Returns the URL to download a MediaSource from, preferring a variant sized to the output."""
+        return sized_variant_url(
+            source.url, source.proxy_url, source.width, source.height,
+            self.max_output_side, source.content_type
+        )
+
+    async def _cached_result(self, operation, media_bytes, **params):
+        """Looks up a previous result for the same input and parameters. Returns (key, entry or None)."""
+        loop = asyncio.get_running_loop()
+        key = await loop.run_in_executor(None, lambda: make_key(media_bytes, operation, **params))
+        entry = await self.result_cache.get(key)
+        stats = self.result_cache.stats()
+        logging.info(f"[ImageCache] {operation} {'hit' if entry else 'miss'} (hit ratio {stats['overall_hit_ratio']:.0%}, {stats['entries']} in memory, {stats['disk_entries']} on disk)")
+        return key, entry
 
     @commands.command()
     async def caption(self, ctx, *, text: str):
@@ -36,53 +69,47 @@ class ImageCog(commands.Cog, name="Image"):
             await ctx.send("Please provide text for the caption.")
             return
 
-        image_url = None
-        if ctx.message.attachments:
-            image_url = ctx.message.attachments[0].url
-        elif ctx.message.reference:
-            ref_message = await ctx.channel.fetch_message(ctx.message.reference.message_id)
-            if ref_message.attachments:
-                image_url = ref_message.attachments[0].url
-            elif ref_message.embeds:
-                for embed in ref_message.embeds:
-                    if embed.image:
-                        image_url = embed.image.url
-                        break
-                    elif embed.thumbnail:
-                        image_url = embed.thumbnail.url
-                        break
-
-        if not image_url:
+        # gifv embeds (Tenor, GIPHY) are videos; their thumbnail is captioned instead.
+        source = await self.resolver.resolve(ctx.message, prefer_image=True)
+        if source is None or source.kind != "image":
             await ctx.send("Please provide an image to caption (either as an attachment or by replying to a message with an image).")
             return
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url) as resp:
-                    if resp.status != 200:
-                        await ctx.send("Could not download the image.")
-                        return
-                    image_bytes = await resp.read()
-
-            is_animated_image = False
-            try:
-                img_check = Image.open(io.BytesIO(image_bytes))
-                if hasattr(img_check, 'is_animated') and img_check.is_animated:
-                    is_animated_image = True
-            except IOError:
-                pass
+            image_bytes, info = await self.bot.media.fetch_image(self._source_url(source))
 
-            loop = asyncio.get_event_loop()
-            result_bytes = await loop.run_in_executor(None, add_caption_to_image, image_bytes, caption_text, is_animated_image, multiplier)
+            cache_key, cached = await self._cached_result("caption", image_bytes, text=caption_text, multiplier=multiplier)
+            if cached:
+                result_bytes, meta = cached
+                await loading_msg.delete()
+                await ctx.send(file=discord.File(fp=io.BytesIO(result_bytes), filename=meta["filename"]))
+                return
+
+            is_animated_image = info.is_animated
+
+            async def on_queued(position):
+                await loading_msg.edit(content=f"Adding caption... you are #{position} in the queue.")
+
+            result_bytes = await self.bot.image_engine.submit(
+                add_caption_to_image, image_bytes, caption_text, is_animated_image, multiplier,
+                on_queued=on_queued
+            )
 
             if result_bytes:
                 filename = "captioned.gif" if is_animated_image else "captioned.png"
+                await self.result_cache.put(cache_key, result_bytes, {"format": "GIF" if is_animated_image else "PNG", "filename": filename})
                 file = discord.File(fp=io.BytesIO(result_bytes), filename=filename)
                 await loading_msg.delete()
                 await ctx.send(file=file)
             else:
                 await ctx.send("Could not process the image. It might be an unsupported format.")
 
+        except MediaError as e:
+            await ctx.send(str(e))
+        except QueueFullError:
+            await ctx.send("The image queue is full right now. Please try again in a moment.")
+        except asyncio.TimeoutError:
+            await ctx.send("Processing the image took too long and was cancelled.")
         except Exception as e:
             logging.error(f"Error in caption command: {e}")
             await ctx.send("An error occurred while processing the image.")
@@ -90,68 +117,34 @@ class ImageCog(commands.Cog, name="Image"):
     @commands.command()
     async def togif(self, ctx):
         """Converts an image into a GIF."""
-        media_url = None
-        filename = "source"
-
-        if ctx.message.attachments:
-            attachment = ctx.message.attachments[0]
-            if attachment.content_type and 'video' in attachment.content_type:
-                await ctx.send("This command no longer supports video conversion.")
-                return
-            media_url = attachment.url
-            if attachment.filename:
-                filename = attachment.filename
-
-        elif ctx.message.reference:
-            ref_message = await ctx.channel.fetch_message(ctx.message.reference.message_id)
-            if ref_message.attachments:
-                attachment = ref_message.attachments[0]
-                if attachment.content_type and 'video' in attachment.content_type:
-                    await ctx.send("This command no longer supports video conversion.")
-                    return
-                media_url = attachment.url
-                if attachment.filename:
-                    filename = attachment.filename
-            elif ref_message.embeds:
-                for embed in ref_message.embeds:
-                    if embed.video:
-                        await ctx.send("This command no longer supports video conversion.")
-                        return
-                    elif embed.image:
-                        media_url = embed.image.url
-                        break
-                    elif embed.thumbnail:
-                        media_url = embed.thumbnail.url
-                        break
-        
-        if not media_url:
+        source = await self.resolver.resolve(ctx.message)
+        if source is None:
             await ctx.send("Please provide an image to convert (either as an attachment or by replying to a message).")
             return
+        if source.kind == "video":
+            await ctx.send("This command no longer supports video conversion.")
+            return
+        filename = source.filename or "source"
 
         status_message = await ctx.send(f"Processing `{filename}`... this may take a moment.")
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.head(media_url) as resp:
-                    if resp.status != 200:
-                        await ctx.send("Could not access the image file.")
-                        return
-                    size = resp.headers.get('Content-Length')
-                    if size and int(size) > 25 * 1024 * 1024:
-                        await ctx.send("The source image is too large to process (must be under 25MB).")
-                        return
-
-                async with session.get(media_url) as resp:
-                    if resp.status != 200:
-                        await ctx.send("Could not download the image file.")
-                        return
-                    media_bytes = await resp.read()
-
-            loop = asyncio.get_event_loop()
-            result_bytes, error_message = await loop.run_in_executor(
-                None, 
-                convert_to_gif, 
-                media_bytes, 
-                self.bot.max_gif_size
+            media_bytes, _ = await self.bot.media.fetch_image(self._source_url(source))
+
+            cache_key, cached = await self._cached_result("togif", media_bytes, max_size=self.bot.max_gif_size)
+            if cached:
+                result_bytes, meta = cached
+                await status_message.delete()
+                await ctx.send(content=_format_tradeoffs(meta.get("tradeoffs")), file=discord.File(fp=io.BytesIO(result_bytes), filename=meta["filename"]))
+                return
+
+            async def on_queued(position):
+                await status_message.edit(content=f"Processing `{filename}`... you are #{position} in the queue.")
+
+            result_bytes, error_message, tradeoffs = await self.bot.image_engine.submit(
+                convert_to_gif,
+                media_bytes,
+                self.bot.max_gif_size,
+                on_queued=on_queued
             )
 
             if error_message:
@@ -159,12 +152,19 @@ class ImageCog(commands.Cog, name="Image"):
                 return
 
             if result_bytes:
+                await self.result_cache.put(cache_key, result_bytes, {"format": "GIF", "filename": "converted.gif", "tradeoffs": tradeoffs})
                 file = discord.File(fp=io.BytesIO(result_bytes), filename="converted.gif")
                 await status_message.delete()
-                await ctx.send(file=file)
+                await ctx.send(content=_format_tradeoffs(tradeoffs), file=file)
             else:
                 await status_message.edit(content="Could not convert to GIF. The format might be unsupported.")
 
+        except MediaError as e:
+            await status_message.edit(content=f"Error: {e}")
+        except QueueFullError:
+            await status_message.edit(content="The image queue is full right now. Please try again in a moment.")
+        except asyncio.TimeoutError:
+            await status_message.edit(content="The conversion took too long and was cancelled.")
         except Exception as e:
             logging.error(f"Error in togif command: {e}")
             await status_message.edit(content="An unexpected error occurred during conversion.")
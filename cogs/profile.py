@@ -1,38 +1,178 @@
 
 import discord
 from discord.ext import commands
+import asyncio
+import hashlib
 import json
+import logging
 import os
-from PIL import Image, ImageDraw, ImageFont
-import aiohttp
+import time
 import configparser
 import io
 
+from utils.cache import LRUCache
+from utils.image_utils import AVATAR_SIZE, prepare_avatar, prepare_profile_background, render_profile_card
+from utils.result_cache import ResultCache
+from utils.image_engine import QueueFullError
+from utils.media import MediaError
+from utils.storage import WriteBehindFlusher, atomic_write
+
 # --- Helper Functions ---
 
 def get_profile_path(guild_id, user_id):
     return f'servers/profiles/{guild_id}/{user_id}'
 
+def default_profile_data():
+    return {
+        "description": "No description set.",
+        "color": "#ffffff",
+        "reputation": 0,
+        "badges": []
+    }
+
 def get_profile_data(guild_id, user_id):
     profile_dir = get_profile_path(guild_id, user_id)
     profile_file = f'{profile_dir}/profile.json'
     if not os.path.exists(profile_file):
-        # Default profile structure
-        return {
-            "description": "No description set.",
-            "color": "#ffffff",
-            "reputation": 0,
-            "badges": []
-        }
+        return default_profile_data()
     with open(profile_file, 'r') as f:
         return json.load(f)
 
-def save_profile_data(guild_id, user_id, data):
-    profile_dir = get_profile_path(guild_id, user_id)
-    os.makedirs(profile_dir, exist_ok=True)
-    profile_file = f'{profile_dir}/profile.json'
-    with open(profile_file, 'w') as f:
-        json.dump(data, f, indent=4)
+def get_background_path(profile_dir):
+    """Path of the pre-scaled background base made at upload time."""
+    return f'{profile_dir}/background.jpg'
+
+def get_legacy_background_path(profile_dir):
+    """Path of a raw background saved before uploads were normalized."""
+    return f'{profile_dir}/background.png'
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def save_profile_files(serialized_profiles):
+    """Writes {(guild_id, user_id): json_text} to disk. Runs in an executor."""
+    for (guild_id, user_id), text in serialized_profiles.items():
+        atomic_write(f'{get_profile_path(guild_id, user_id)}/profile.json', text)
+
+# Bump whenever the card layout changes so previously cached cards are re-rendered.
+CARD_LAYOUT_VERSION = 2
+
+# Sizes the Discord CDN can serve an avatar at.
+CDN_SIZES = [16, 32, 64, 128, 256, 512, 1024, 2048, 4096]
+
+def get_card_version(profile_data, display_name, background_stat, avatar_key, trivia_wins, hangman_wins):
+    """Returns a hash of every input that affects how a profile card looks."""
+    inputs = {
+        "layout": CARD_LAYOUT_VERSION,
+        "profile": profile_data,
+        "name": display_name,
+        "background": background_stat,
+        "avatar": avatar_key,
+        "wins": [trivia_wins, hangman_wins],
+    }
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+def read_cached_card(profile_dir, version):
+    """Returns the saved card if it was rendered for this version, otherwise None."""
+    try:
+        with open(f'{profile_dir}/profile_card.version', 'r') as f:
+            if f.read().strip() != version:
+                return None
+        with open(f'{profile_dir}/profile_card.png', 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def save_background(profile_dir, base_bytes):
+    atomic_write(get_background_path(profile_dir), base_bytes)
+    try:
+        os.remove(get_legacy_background_path(profile_dir))
+    except FileNotFoundError:
+        pass
+
+def save_cached_card(profile_dir, version, card_bytes):
+    atomic_write(f'{profile_dir}/profile_card.png', card_bytes)
+    atomic_write(f'{profile_dir}/profile_card.version', version)
+
+def _profile_size(data):
+    # Rough in-memory cost of a profile: its serialized size plus dict overhead.
+    return len(json.dumps(data)) + 256
+
+# --- Profile Cache ---
+
+class ProfileCache:
+    """LRU-bounded cache of profile data with write-behind persistence.
+
+    Reads are served from memory after the first load. Saves only mark the
+    entry dirty; dirty entries are written off the event loop in batches.
+    Dirty entries evicted before their flush are kept aside until written.
+    """
+
+    def __init__(self, max_bytes, flush_delay=5.0):
+        self._cache = LRUCache(max_bytes, sizeof=_profile_size, on_evict=self._on_evict)
+        self._dirty = set()
+        self._pending = {}  # Dirty entries evicted before being flushed
+        self._flusher = WriteBehindFlusher(self._flush, delay=flush_delay)
+
+    def _on_evict(self, key, data):
+        if key in self._dirty:
+            self._pending[key] = data
+
+    async def get(self, guild_id, user_id):
+        """Returns a user's profile data, loading it from disk on a miss."""
+        key = (str(guild_id), str(user_id))
+        data = self._cache.get(key)
+        if data is None:
+            data = self._pending.pop(key, None)
+            if data is None:
+                loop = asyncio.get_running_loop()
+                loaded = await loop.run_in_executor(None, get_profile_data, *key)
+                # Another caller may have loaded (and saved) this profile meanwhile; keep theirs.
+                data = self._cache.peek(key)
+                if data is None:
+                    data = self._pending.pop(key, loaded)
+            self._cache.put(key, data)
+        return data
+
+    def save(self, guild_id, user_id, data):
+        """Stores a user's profile data and schedules it to be written."""
+        key = (str(guild_id), str(user_id))
+        self._pending.pop(key, None)
+        self._dirty.add(key)
+        self._cache.put(key, data)
+        self._flusher.mark_dirty(key)
+
+    async def _flush(self, keys):
+        snapshot = {}
+        for key in keys:
+            data = self._pending.pop(key, None)
+            if data is None:
+                data = self._cache.peek(key)
+            if data is None:
+                continue
+            snapshot[key] = data
+            self._dirty.discard(key)
+
+        serialized = {key: json.dumps(data, indent=4) for key, data in snapshot.items()}
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, save_profile_files, serialized)
+        except BaseException:
+            for key, data in snapshot.items():
+                self._dirty.add(key)
+                if key not in self._cache:
+                    self._pending[key] = data
+            raise
+
+    async def close(self):
+        """Writes every dirty entry."""
+        await self._flusher.close()
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats["dirty"] = len(self._dirty)
+        return stats
 
 # --- Cog Class ---
 
@@ -43,6 +183,25 @@ class Profile(commands.Cog):
         config.read('bot-settings.ini')
         self.bg_size_limit_mb = config.getint('profile', 'background_size_limit_mb', fallback=1)
         self.bg_size_limit_bytes = self.bg_size_limit_mb * 1024 * 1024
+        self.profiles = ProfileCache(
+            max_bytes=config.getint('profile', 'cache_size_mb', fallback=8) * 1024 * 1024,
+            flush_delay=config.getfloat('profile', 'flush_seconds', fallback=5.0)
+        )
+        # Masked avatars keyed by avatar hash; the hash changes whenever the avatar does.
+        self.avatars = ResultCache(
+            memory_bytes=config.getint('profile', 'avatar_cache_mb', fallback=8) * 1024 * 1024,
+            disk_dir=config.get('profile', 'avatar_cache_dir', fallback='servers/cache/avatars'),
+            disk_bytes=config.getint('profile', 'avatar_cache_disk_mb', fallback=128) * 1024 * 1024
+        )
+        # {(guild_id, user_id): (version, card_bytes)}
+        self.cards = LRUCache(
+            config.getint('profile', 'card_cache_mb', fallback=16) * 1024 * 1024,
+            sizeof=lambda entry: len(entry[1])
+        )
+
+    async def cog_unload(self):
+        await self.profiles.close()
+        logging.info(f"Profile cache stats: {self.profiles.stats()}")
 
     # --- Commands ---
 
@@ -54,71 +213,100 @@ class Profile(commands.Cog):
         user = user or ctx.author
 
         # Load data
-        profile_data = get_profile_data(ctx.guild.id, user.id)
+        profile_data = await self.profiles.get(ctx.guild.id, user.id)
         profile_dir = get_profile_path(ctx.guild.id, user.id)
-        bg_image_path = f'{profile_dir}/background.png'
+        bg_image_path = get_background_path(profile_dir)
 
         if not os.path.exists(bg_image_path):
-            await ctx.send(f"{user.mention} hasn't set a background image yet! Use `!setbg`.")
-            return
-
-        # --- Image Generation ---
-        card = Image.open(bg_image_path).convert('RGBA').resize((800, 300))
-        overlay = Image.new('RGBA', card.size, (0, 0, 0, 128))
-        card.paste(overlay, (0, 0), overlay)
-
-        # Avatar
-        async with aiohttp.ClientSession() as session:
-            async with session.get(str(user.avatar.url)) as resp:
-                avatar_data = await resp.read()
-        avatar = Image.open(io.BytesIO(avatar_data)).convert('RGBA').resize((150, 150))
-        mask = Image.new('L', avatar.size, 0)
-        draw_mask = ImageDraw.Draw(mask)
-        draw_mask.ellipse((0, 0) + avatar.size, fill=255)
-        card.paste(avatar, (50, 75), mask)
-
-        # Text
-        draw = ImageDraw.Draw(card)
-        font_bold = ImageFont.truetype('utils/fonts/OpenSans-Bold.ttf', 36)
-        font_regular = ImageFont.truetype('utils/fonts/OpenSans-Regular.ttf', 24)
-        
-        user_color = profile_data.get('color', '#ffffff')
-        draw.text((240, 100), user.display_name, font=font_bold, fill=user_color)
-        draw.text((240, 150), profile_data.get('description', 'No description.'), font=font_regular, fill=(220, 220, 220))
+            if not os.path.exists(get_legacy_background_path(profile_dir)):
+                await ctx.send(f"{user.mention} hasn't set a background image yet! Use `!setbg`.")
+                return
+            # Backgrounds uploaded before normalization are converted on first use.
+            try:
+                await self._migrate_background(profile_dir)
+            except (QueueFullError, asyncio.TimeoutError):
+                await loading_msg.edit(content="Couldn't prepare the background right now. Please try again in a moment.")
+                return
+        bg_stat = os.stat(bg_image_path)
 
-        # Stats & Badges
-        rep = profile_data.get('reputation', 0)
-        
         # --- Load Leaderboard Stats ---
-        try:
-            with open('servers/leaderboard.json', 'r') as f:
-                leaderboard = json.load(f)
-            user_stats = leaderboard.get(str(ctx.guild.id), {}).get(str(user.id), {})
-            trivia_wins = user_stats.get('trivia_wins', 0)
-            hangman_wins = user_stats.get('hangman_wins', 0)
-        except FileNotFoundError:
-            trivia_wins, hangman_wins = 0, 0
-
-        stats_text = f"Rep: {rep} | Trivia Wins: {trivia_wins} | Hangman Wins: {hangman_wins}"
-        draw.text((240, 200), stats_text, font=font_regular, fill=(220, 220, 220))
-
-        # --- Badge Logic ---
-        badge_x = 240
-        if trivia_wins >= 5:
-            # In a real scenario, you'd load a badge image. For now, we'll draw a placeholder.
-            draw.rectangle((badge_x, 240, badge_x + 30, 270), fill=('gold'))
-            draw.text((badge_x + 5, 245), "T", font=font_regular, fill=('black'))
-            badge_x += 40
-        if hangman_wins >= 5:
-            draw.rectangle((badge_x, 240, badge_x + 30, 270), fill=('silver'))
-            draw.text((badge_x + 5, 245), "H", font=font_regular, fill=('black'))
-
-
-        # Save and send
-        final_card_path = f'{profile_dir}/profile_card.png'
-        card.save(final_card_path)
+        user_stats = await self.bot.storage.get_scores(ctx.guild.id, user.id)
+        trivia_wins = user_stats.get('trivia_wins', 0)
+        hangman_wins = user_stats.get('hangman_wins', 0)
+
+        # --- Cached Card Lookup ---
+        # The card is only re-rendered when one of its inputs has changed.
+        version = get_card_version(
+            profile_data, user.display_name, [bg_stat.st_mtime_ns, bg_stat.st_size],
+            user.display_avatar.key, trivia_wins, hangman_wins
+        )
+        card_key = (str(ctx.guild.id), str(user.id))
+        loop = asyncio.get_running_loop()
+        cached = self.cards.get(card_key)
+        card_bytes = cached[1] if cached and cached[0] == version else None
+        if card_bytes is None:
+            card_bytes = await loop.run_in_executor(None, read_cached_card, profile_dir, version)
+        if card_bytes is None:
+            try:
+                card_bytes = await self._render_card(user, profile_data, bg_image_path, trivia_wins, hangman_wins)
+            except QueueFullError:
+                await loading_msg.edit(content="The image queue is full right now. Please try again in a moment.")
+                return
+            except asyncio.TimeoutError:
+                await loading_msg.edit(content="Rendering the profile card took too long. Please try again later.")
+                return
+            except MediaError as e:
+                await loading_msg.edit(content=f"Couldn't load {user.display_name}'s avatar: {e}")
+                return
+            await loop.run_in_executor(None, save_cached_card, profile_dir, version, card_bytes)
+        self.cards.put(card_key, (version, card_bytes))
+
         await loading_msg.delete()
-        await ctx.send(file=discord.File(final_card_path))
+        await ctx.send(file=discord.File(fp=io.BytesIO(card_bytes), filename='profile_card.png'))
+
+    async def _migrate_background(self, profile_dir):
+        """Normalizes a legacy raw background.png into the pre-scaled base."""
+        loop = asyncio.get_running_loop()
+        raw_bytes = await loop.run_in_executor(None, read_file, get_legacy_background_path(profile_dir))
+        base_bytes = await self.bot.image_engine.submit(prepare_profile_background, raw_bytes)
+        await loop.run_in_executor(None, save_background, profile_dir, base_bytes)
+
+    async def _get_avatar(self, user):
+        """Returns a user's masked avatar, downloading it only the first time its hash is seen."""
+        asset = user.display_avatar  # Falls back to the default avatar
+        key = f"{asset.key}-{AVATAR_SIZE[0]}"
+        cached = await self.avatars.get(key)
+        if cached:
+            return cached[0]
+
+        # Fetch the smallest CDN size that still covers the card's avatar slot.
+        size = next((s for s in CDN_SIZES if s >= max(AVATAR_SIZE)), CDN_SIZES[-1])
+        raw_bytes, _ = await self.bot.media.fetch_image(asset.replace(size=size, format='png').url)
+        masked_bytes = await self.bot.image_engine.submit(prepare_avatar, raw_bytes)
+        await self.avatars.put(key, masked_bytes, {"format": "PNG"})
+        return masked_bytes
+
+    async def _render_card(self, user, profile_data, bg_image_path, trivia_wins, hangman_wins):
+        """Fetches the card's inputs, then composites it in the image worker pool. Returns PNG bytes."""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+
+        async def read_background():
+            return await loop.run_in_executor(None, read_file, bg_image_path)
+
+        background_bytes, avatar_bytes = await asyncio.gather(read_background(), self._get_avatar(user))
+        downloaded = time.perf_counter()
+
+        card_bytes, timings = await self.bot.image_engine.submit(
+            render_profile_card, background_bytes, avatar_bytes, user.display_name,
+            profile_data, trivia_wins, hangman_wins
+        )
+        logging.info(
+            f"[Profile] Rendered card for {user.id}: download {(downloaded - start) * 1000:.1f}ms, "
+            f"compose {timings['compose']:.1f}ms, encode {timings['encode']:.1f}ms, "
+            f"total {(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+        return card_bytes
 
     @commands.command(name='setbg')
     async def set_background(self, ctx):
@@ -137,8 +325,25 @@ class Profile(commands.Cog):
             return
 
         profile_dir = get_profile_path(ctx.guild.id, ctx.author.id)
-        os.makedirs(profile_dir, exist_ok=True)
-        await attachment.save(f'{profile_dir}/background.png')
+        try:
+            raw_bytes, _ = await self.bot.media.fetch_image(attachment.url, max_bytes=self.bg_size_limit_bytes)
+            base_bytes = await self.bot.image_engine.submit(prepare_profile_background, raw_bytes)
+        except MediaError as e:
+            await ctx.send(str(e))
+            return
+        except QueueFullError:
+            await ctx.send("The image queue is full right now. Please try again in a moment.")
+            return
+        except asyncio.TimeoutError:
+            await ctx.send("Processing your background took too long. Try a smaller image.")
+            return
+        except Exception as e:
+            logging.error(f"Error preparing profile background: {e}")
+            await ctx.send("Could not read that image. Please upload a PNG, JPEG or GIF.")
+            return
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, save_background, profile_dir, base_bytes)
         await ctx.send("Your background has been updated!")
 
     @commands.command(name='setdesc')
@@ -148,9 +353,9 @@ class Profile(commands.Cog):
             await ctx.send("Your description must be 100 characters or less.")
             return
         
-        data = get_profile_data(ctx.guild.id, ctx.author.id)
+        data = await self.profiles.get(ctx.guild.id, ctx.author.id)
         data['description'] = description
-        save_profile_data(ctx.guild.id, ctx.author.id, data)
+        self.profiles.save(ctx.guild.id, ctx.author.id, data)
         await ctx.send("Your description has been updated!")
 
     @commands.command(name='setcolor')
@@ -160,9 +365,9 @@ class Profile(commands.Cog):
             await ctx.send("Invalid hex code. Please use the format `#xxxxxx`.")
             return
         
-        data = get_profile_data(ctx.guild.id, ctx.author.id)
+        data = await self.profiles.get(ctx.guild.id, ctx.author.id)
         data['color'] = color
-        save_profile_data(ctx.guild.id, ctx.author.id, data)
+        self.profiles.save(ctx.guild.id, ctx.author.id, data)
         await ctx.send(f"Your color has been set to {color}!")
 
     @commands.command(name='rep')
@@ -173,9 +378,9 @@ class Profile(commands.Cog):
             await ctx.send("You can't give reputation to yourself.")
             return
 
-        data = get_profile_data(ctx.guild.id, user.id)
+        data = await self.profiles.get(ctx.guild.id, user.id)
         data['reputation'] = data.get('reputation', 0) + 1
-        save_profile_data(ctx.guild.id, user.id, data)
+        self.profiles.save(ctx.guild.id, user.id, data)
         await ctx.send(f"You have given a reputation point to {user.mention}!")
 
     @give_reputation.error
@@ -2,8 +2,6 @@ import discord
 from discord.ext import commands
 import aiohttp
 import logging
-import json
-import os
 import uuid
 import re
 from datetime import datetime
@@ -11,6 +9,21 @@ from tmdbv3api import TMDb, Movie
 import html
 import speedtest
 import asyncio
+import configparser
+import time
+
+from sortedcontainers import SortedList
+
+from utils.response_cache import ResponseCache, normalize_url
+from utils.singleflight import SingleFlight
+
+# How long lookups from each API stay fresh, in seconds. Overridable in [response_cache_ttl].
+DEFAULT_RESPONSE_TTLS = {
+    "api.dictionaryapi.dev": 86400,
+    "en.wikipedia.org": 3600,
+    "api.tvmaze.com": 21600,
+    "api.github.com": 600,
+}
 
 class Utility(commands.Cog):
     """Utility commands for dictionary, lookups, surveys, and more."""
@@ -21,8 +34,22 @@ class Utility(commands.Cog):
         self.wikipedia_api_url = "https://en.wikipedia.org/w/api.php"
         self.github_api_url = "https://api.github.com/repos/"
         self.tvmaze_api_url = "https://api.tvmaze.com/singlesearch/shows"
-        self.surveys_file = "servers/surveys.json"
-        self.surveys = self._load_surveys()
+        self.surveys = {}
+        self._rankings = {}  # {(guild_id, survey_id): SortedList[(-count, answer_key)]}, built on first view
+
+        config = configparser.ConfigParser()
+        config.read('bot-settings.ini')
+        ttls = dict(DEFAULT_RESPONSE_TTLS)
+        if config.has_section('response_cache_ttl'):
+            ttls.update({host: config.getfloat('response_cache_ttl', host) for host in config.options('response_cache_ttl')})
+        self.responses = ResponseCache(
+            memory_bytes=config.getint('response_cache', 'memory_mb', fallback=8) * 1024 * 1024,
+            default_ttl=config.getfloat('response_cache', 'default_ttl_seconds', fallback=3600.0),
+            ttls=ttls,
+            negative_ttl=config.getfloat('response_cache', 'negative_ttl_seconds', fallback=600.0),
+            storage=self.bot.storage if config.getboolean('response_cache', 'persistent', fallback=True) else None
+        )
+        self.requests = SingleFlight()
 
         if hasattr(bot, 'tmdb_api_key') and bot.tmdb_api_key and bot.tmdb_api_key != 'YOUR_TMDB_API_KEY':
             self.tmdb = TMDb()
@@ -30,41 +57,93 @@ class Utility(commands.Cog):
         else:
             self.tmdb = None
 
-    def _load_surveys(self):
-        """Loads survey data from the JSON file."""
-        if os.path.exists(self.surveys_file):
-            with open(self.surveys_file, 'r') as f:
-                try:
-                    return json.load(f)
-                except json.JSONDecodeError:
-                    logging.warning(f"Surveys file '{self.surveys_file}' is empty or malformed.")
-                    return {}
-        return {}
-
-    def _save_surveys(self):
-        """Saves current survey data to the JSON file."""
-        os.makedirs(os.path.dirname(self.surveys_file), exist_ok=True)
-        with open(self.surveys_file, 'w') as f:
-            json.dump(self.surveys, f, indent=4)
+    async def cog_load(self):
+        """Loads survey data from the shared storage."""
+        self.surveys = await self.bot.storage.load_surveys()
+        for guild_surveys in self.surveys.values():
+            for survey in guild_surveys.values():
+                self._upgrade_survey(survey)
+        if self.responses.storage is not None:
+            purged = await self.bot.storage.purge_cached_responses(time.time())
+            if purged:
+                logging.info(f"[ResponseCache] Purged {purged} expired response(s).")
+
+    @staticmethod
+    def _normalize_answer(answer):
+        """Normalizes a survey answer so equivalent responses are tallied together."""
+        return " ".join(answer.split()).casefold()
+
+    def _upgrade_survey(self, survey):
+        """Converts legacy list-shaped responses and builds missing tallies."""
+        responses = survey.get("responses", {})
+        if isinstance(responses, list):
+            responses = {str(r["user_id"]): r["answer"] for r in responses if "user_id" in r and "answer" in r}
+        survey["responses"] = responses
+        if "owner_id" not in survey and "creator_id" in survey:
+            survey["owner_id"] = int(survey["creator_id"])
+
+        if "tallies" not in survey:
+            survey["tallies"] = {}
+            survey["labels"] = {}
+            for answer in responses.values():
+                self._tally_answer(survey, answer, 1)
+
+    def _tally_answer(self, survey, answer, delta, ranking=None):
+        """Adjusts the running tally for an answer by delta, and its place in `ranking` if given."""
+        key = self._normalize_answer(answer)
+        previous = survey["tallies"].get(key, 0)
+        count = previous + delta
+        if ranking is not None:
+            if previous:
+                ranking.remove((-previous, key))
+            if count > 0:
+                ranking.add((-count, key))
+        if count > 0:
+            survey["tallies"][key] = count
+            survey["labels"].setdefault(key, " ".join(answer.split()))
+        else:
+            survey["tallies"].pop(key, None)
+            survey["labels"].pop(key, None)
+
+    def _ranking(self, guild_id, survey_id):
+        """Returns a survey's answers ordered by votes, sorting its tallies only the first time."""
+        ranking = self._rankings.get((guild_id, survey_id))
+        if ranking is None:
+            tallies = self.surveys[guild_id][survey_id]["tallies"]
+            ranking = self._rankings[(guild_id, survey_id)] = SortedList((-count, key) for key, count in tallies.items())
+        return ranking
+
+    async def _save_survey(self, guild_id, survey_id):
+        """Saves a single survey to the shared storage."""
+        await self.bot.storage.save_survey(guild_id, survey_id, self.surveys[guild_id][survey_id])
 
     async def fetch_json(self, url, params=None):
-        """Helper to fetch JSON from a given URL."""
-        headers = {
-            'User-Agent': 'YikersDiscordBot/1.0 (https://github.com/YikeGames-P/yikers-discord-bot)'
-        }
-        async with aiohttp.ClientSession(headers=headers) as session:
-            try:
-                async with session.get(url, params=params) as response:
-                    if response.status == 404:
-                        return None # Gracefully handle Not Found
-                    response.raise_for_status()
-                    return await response.json()
-            except aiohttp.ClientError as e:
-                logging.error(f"API request failed for {url}: {e}")
-                return None
-            except Exception as e:
-                logging.error(f"An unexpected error occurred during API fetch for {url}: {e}")
-                return None
+        """Helper to fetch JSON from a given URL. Responses (and 404s) are cached per API.
+
+        Identical lookups that are already in flight share one upstream request.
+        """
+        key = normalize_url(url, params)
+        hit, data = await self.responses.get(key)
+        if hit:
+            return data
+        return await self.requests.run(key, self._fetch_uncached, key, url, params)
+
+    async def _fetch_uncached(self, key, url, params):
+        try:
+            async with self.bot.http_client.get(url, params=params) as response:
+                if response.status == 404:
+                    await self.responses.put(key, url, 404, None)
+                    return None # Gracefully handle Not Found
+                response.raise_for_status()
+                data = await response.json()
+            await self.responses.put(key, url, 200, data)
+            return data
+        except aiohttp.ClientError as e:
+            logging.error(f"API request failed for {url}: {e}")
+            return None
+        except Exception as e:
+            logging.error(f"An unexpected error occurred during API fetch for {url}: {e}")
+            return None
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -248,6 +327,8 @@ class Utility(commands.Cog):
             "owner_id": ctx.author.id,
             "active": True,
             "responses": {},
+            "tallies": {}, # {normalized_answer: count}
+            "labels": {}, # {normalized_answer: answer as first written}
             "message_id": None # To be filled after sending message
         }
 
@@ -260,7 +341,7 @@ class Utility(commands.Cog):
         
         msg = await ctx.send(embed=embed)
         self.surveys[guild_id][survey_id]["message_id"] = msg.id
-        self._save_surveys()
+        await self._save_survey(guild_id, survey_id)
 
     @survey_group.command(name="respond")
     async def respond_survey(self, ctx, survey_id: str, *, answer: str):
@@ -277,13 +358,18 @@ class Utility(commands.Cog):
             await ctx.send("This survey is no longer active.")
             return
 
+        ranking = self._rankings.get((guild_id, survey_id))
+        previous = survey["responses"].get(user_id)
+        if previous is not None:
+            self._tally_answer(survey, previous, -1, ranking)
         survey["responses"][user_id] = answer
-        self._save_surveys()
+        self._tally_answer(survey, answer, 1, ranking)
+        await self._save_survey(guild_id, survey_id)
         await ctx.message.add_reaction("✅")
 
     @survey_group.command(name="view")
-    async def view_survey(self, ctx, survey_id: str):
-        """Views the question and responses of a survey."""
+    async def view_survey(self, ctx, survey_id: str, page: int = 1):
+        """Views the question and responses of a survey. Usage: ?survey view <id> [page]"""
         guild_id = str(ctx.guild.id)
         if guild_id not in self.surveys or survey_id not in self.surveys[guild_id]:
             await ctx.send("Invalid survey ID.")
@@ -291,25 +377,27 @@ class Utility(commands.Cog):
 
         survey = self.surveys[guild_id][survey_id]
         question = survey["question"]
-        responses = survey["responses"]
+        tallies = survey["tallies"]
 
         embed = discord.Embed(
             title=f"Survey Results: {question}",
             color=discord.Color.blurple()
         )
 
-        if not responses:
+        if not tallies:
             embed.description = "No responses yet."
         else:
-            # Count responses
-            response_counts = {}
-            for response in responses.values():
-                response_counts[response] = response_counts.get(response, 0) + 1
-            
+            page_size = 10
+            total_pages = (len(tallies) + page_size - 1) // page_size
+            page = max(1, min(page, total_pages))
+            ranking = self._ranking(guild_id, survey_id)
+
             description = ""
-            for response, count in sorted(response_counts.items(), key=lambda item: item[1], reverse=True):
-                description += f"**{response}**: {count} vote(s)\n"
+            for neg_count, key in ranking.islice((page - 1) * page_size, page * page_size):
+                description += f"**{survey['labels'].get(key, key)}**: {-neg_count} vote(s)\n"
             embed.description = description
+            if total_pages > 1:
+                embed.set_footer(text=f"Page {page}/{total_pages} | {len(survey['responses'])} response(s)")
 
         await ctx.send(embed=embed)
 
@@ -332,7 +420,7 @@ class Utility(commands.Cog):
              return
 
         survey["active"] = False
-        self._save_surveys()
+        await self._save_survey(guild_id, survey_id)
 
         await ctx.send(f"Survey `{survey_id}` has been closed. Use `?survey view {survey_id}` to see the final results.")
 
@@ -352,7 +440,7 @@ class Utility(commands.Cog):
             self.bot.settings[guild_id]['custom_commands'] = {}
         
         self.bot.settings[guild_id]['custom_commands'][name] = response
-        self.bot.save_settings()
+        self.bot.save_settings(guild_id)
         await ctx.send(f"Custom command `{name}` has been saved.")
 
     @customcmd.command(name="delete")
@@ -362,7 +450,7 @@ class Utility(commands.Cog):
         guild_id = str(ctx.guild.id)
         if 'custom_commands' in self.bot.settings[guild_id] and name in self.bot.settings[guild_id]['custom_commands']:
             del self.bot.settings[guild_id]['custom_commands'][name]
-            self.bot.save_settings()
+            self.bot.save_settings(guild_id)
             await ctx.send(f"Custom command `{name}` has been deleted.")
         else:
             await ctx.send(f"Custom command `{name}` not found.")
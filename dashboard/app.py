@@ -92,7 +92,9 @@ def run_dashboard(bot, loop, app, socketio):
             "status": "Online" if bot.is_ready() else "Offline",
             "latency": f"{bot.latency * 1000:.2f}",
             "server_count": len(guilds),
-            "user_count": total_users
+            "user_count": total_users,
+            "http": bot.http_client.stats(),
+            "upstreams": bot.http_client.policies.stats()
         })
 
     @app.route('/api/servers')
@@ -0,0 +1,57 @@
+import asyncio
+
+from aiohttp import web
+
+from utils.http import HttpClient
+from utils.upstream import CircuitBreaker, UpstreamPolicies
+
+
+async def _serve(handler):
+    app = web.Application()
+    app.router.add_get('/', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/'
+
+
+async def _get_status(retry_after, **settings):
+    async def handler(request):
+        return web.Response(status=429, headers={'Retry-After': retry_after})
+
+    runner, url = await _serve(handler)
+    policies = UpstreamPolicies(overrides={'127.0.0.1': {'max_retries': '0', **settings}})
+    client = HttpClient(policies=policies)
+    await client.open()
+    try:
+        async with client.get(url) as response:
+            status = response.status
+    finally:
+        await client.close()
+        await runner.cleanup()
+    return status, policies.for_host('127.0.0.1').breaker
+
+
+def test_short_retry_after_counts_toward_threshold():
+    status, breaker = asyncio.run(_get_status('1', failure_threshold='5', reset_seconds='30'))
+    assert status == 429
+    assert breaker.failures == 1
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_long_retry_after_opens_for_that_long():
+    status, breaker = asyncio.run(_get_status('120', max_wait='10', failure_threshold='5', reset_seconds='30'))
+    assert status == 429
+    assert breaker.state == CircuitBreaker.OPEN
+    assert 100 < breaker.retry_in() <= 120
+
+
+def test_threshold_opens_for_reset_seconds():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert 25 < breaker.retry_in() <= 30
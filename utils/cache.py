@@ -0,0 +1,84 @@
+import sys
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by the total size of its values.
+
+    `sizeof` estimates how many bytes a value costs; the least recently used
+    entries are evicted once the total goes over `max_bytes`. `on_evict` is
+    called with (key, value) for every entry pushed out by that bound.
+    """
+
+    def __init__(self, max_bytes, sizeof=sys.getsizeof, on_evict=None):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._on_evict = on_evict
+        self._data = OrderedDict()  # {key: (value, size)}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Returns a cached value and marks it as recently used."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return entry[0]
+
+    def peek(self, key, default=None):
+        """Returns a cached value without touching its recency or the counters."""
+        entry = self._data.get(key)
+        return default if entry is None else entry[0]
+
+    def put(self, key, value):
+        """Stores a value, evicting old entries if the cache grows too large."""
+        self.pop(key)
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            if self._on_evict is not None:
+                self._on_evict(key, value)
+            return
+        self._data[key] = (value, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            old_key, (old_value, old_size) = self._data.popitem(last=False)
+            self.current_bytes -= old_size
+            self.evictions += 1
+            if self._on_evict is not None:
+                self._on_evict(old_key, old_value)
+
+    def pop(self, key, default=None):
+        """Removes a value without counting it as an eviction."""
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        self.current_bytes -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        self._data.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        """Returns the cache's counters as a dict."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
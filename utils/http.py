@@ -0,0 +1,117 @@
+import logging
+from collections import Counter
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils.upstream import GuardedRequest, UpstreamPolicies
+
+USER_AGENT = 'YikersDiscordBot/1.0 (https://github.com/YikeGames-P/yikers-discord-bot)'
+
+
+class HttpClient:
+    """The bot's single pooled aiohttp session, shared by every cog.
+
+    Connections are kept alive and reused per host, DNS answers are cached,
+    and every request gets a default timeout unless it passes its own. Trace
+    hooks count how often a request could reuse an open connection. Each
+    request also goes through its host's policy in `policies` (rate limit,
+    concurrency cap, retries and circuit breaker, see utils/upstream.py).
+    Created once in bot startup as `bot.http_client` (discord.py already
+    owns `bot.http`) and closed on shutdown.
+    """
+
+    def __init__(self, limit=100, limit_per_host=10, keepalive_timeout=30.0,
+                 dns_cache_seconds=300, timeout=15.0, connect_timeout=5.0, policies=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_seconds = dns_cache_seconds
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.policies = policies or UpstreamPolicies()
+        self._session = None
+        self._counters = Counter()
+        self._requests_by_host = Counter()
+
+    # --- Lifecycle --- #
+    async def open(self):
+        """Creates the session. Must be called from the bot's event loop."""
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_seconds,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers={'User-Agent': USER_AGENT},
+            trace_configs=[self._trace_config()],
+        )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        logging.info(f"[HTTP] Closed shared session. {self._format_stats()}")
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            raise RuntimeError("HttpClient.open() must be called before making requests.")
+        return self._session
+
+    # --- Requests --- #
+    def request(self, method, url, **kwargs):
+        """Like aiohttp.ClientSession.request, on the shared session and under the host's policy.
+
+        Use as `async with`. Raises UpstreamUnavailableError (an aiohttp.ClientError)
+        when the policy refuses the request.
+        """
+        policy = self.policies.for_host(urlsplit(str(url)).hostname)
+        return GuardedRequest(policy, self.session, method, url, kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    # --- Stats --- #
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        def count(name):
+            async def hook(session, context, params):
+                self._counters[name] += 1
+            return hook
+
+        async def on_request_start(session, context, params):
+            self._counters["requests"] += 1
+            self._requests_by_host[params.url.host] += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_exception.append(count("errors"))
+        trace.on_connection_create_end.append(count("new_connections"))
+        trace.on_connection_reuseconn.append(count("reused_connections"))
+        trace.on_dns_cache_hit.append(count("dns_cache_hits"))
+        trace.on_dns_cache_miss.append(count("dns_cache_misses"))
+        return trace
+
+    def stats(self):
+        """Returns request and connection-reuse counters as a dict."""
+        connections = self._counters["new_connections"] + self._counters["reused_connections"]
+        return {
+            "requests": self._counters["requests"],
+            "errors": self._counters["errors"],
+            "new_connections": self._counters["new_connections"],
+            "reused_connections": self._counters["reused_connections"],
+            "reuse_ratio": self._counters["reused_connections"] / connections if connections else 0.0,
+            "dns_cache_hits": self._counters["dns_cache_hits"],
+            "dns_cache_misses": self._counters["dns_cache_misses"],
+            "requests_by_host": dict(self._requests_by_host),
+        }
+
+    def _format_stats(self):
+        stats = self.stats()
+        return (f"{stats['requests']} request(s), {stats['new_connections']} new connection(s), "
+                f"{stats['reuse_ratio']:.0%} reused, {stats['errors']} error(s)")
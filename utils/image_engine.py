@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class QueueFullError(Exception):
+    """Raised when the image engine can't accept another job."""
+
+
+def _report_pid(pids):
+    """Worker initializer: tells the engine which process to kill if a job hangs."""
+    pids.put(os.getpid())
+
+
+class ImageEngine:
+    """Runs Pillow work from utils/image_utils.py in a dedicated process pool.
+
+    At most `workers` jobs run at once and at most `max_queue` more may wait
+    for a slot; anything beyond that is rejected with QueueFullError. Jobs
+    that run longer than `job_timeout` seconds raise asyncio.TimeoutError and
+    get their worker killed. The pool is replaced every `recycle_after` jobs
+    so leaked memory in long-lived workers is returned to the system.
+    Workers are started from a forkserver rather than forked from the bot,
+    which has other threads running and a large heap.
+    """
+
+    def __init__(self, workers=2, max_queue=8, job_timeout=60.0, recycle_after=200):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.recycle_after = recycle_after
+        self._slots = asyncio.Semaphore(workers)
+        self._context = multiprocessing.get_context("forkserver")
+        self._pool = None
+        self._inflight = {}  # {pool: running job count}
+        self._worker_pids = {}  # {pool: queue of worker PIDs reported by _report_pid}
+        self._doomed = set()  # Retired pools whose workers must be killed once idle
+        self._running = 0
+        self._waiting = 0
+        self._jobs_on_pool = 0
+
+    def _get_pool(self):
+        if self._pool is None:
+            pids = self._context.SimpleQueue()
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context,
+                                             initializer=_report_pid, initargs=(pids,))
+            self._inflight[self._pool] = 0
+            self._worker_pids[self._pool] = pids
+            self._jobs_on_pool = 0
+        return self._pool
+
+    def _retire_pool(self, kill=False):
+        """Stops sending jobs to the current pool; running jobs are allowed to finish."""
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        if kill:
+            self._doomed.add(pool)
+        self._release_pool_if_idle(pool)
+
+    def _release_pool_if_idle(self, pool):
+        if pool is self._pool or self._inflight.get(pool, 0) > 0:
+            return
+        self._inflight.pop(pool, None)
+        pids = self._worker_pids.pop(pool, None)
+        if pool in self._doomed:
+            self._doomed.discard(pool)
+            # A timed-out job can't be cancelled once it is running, so its worker is terminated.
+            while pids is not None and not pids.empty():
+                try:
+                    os.kill(pids.get(), signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        pool.shutdown(wait=False, cancel_futures=True)
+        if pids is not None:
+            pids.close()
+
+    async def submit(self, func, *args, on_queued=None):
+        """Runs func(*args) in the pool and returns its result.
+
+        If every worker is busy, `on_queued` is awaited with the job's 1-based
+        queue position before it starts waiting.
+        """
+        if self._running >= self.workers:
+            if self._waiting >= self.max_queue:
+                raise QueueFullError()
+            self._waiting += 1
+            try:
+                if on_queued is not None:
+                    await on_queued(self._waiting)
+                await self._slots.acquire()
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+
+        self._running += 1
+        pool = self._get_pool()
+        self._inflight[pool] += 1
+        self._jobs_on_pool += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await asyncio.wait_for(loop.run_in_executor(pool, func, *args), self.job_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Image job {getattr(func, '__name__', func)} timed out after {self.job_timeout}s, recycling workers.")
+            if pool is self._pool:
+                self._retire_pool(kill=True)
+            else:
+                self._doomed.add(pool)
+            raise
+        except BrokenProcessPool:
+            logging.error("Image worker pool broke, starting a new one.")
+            if pool is self._pool:
+                self._retire_pool()
+            raise
+        finally:
+            self._running -= 1
+            self._slots.release()
+            self._inflight[pool] -= 1
+            if pool is self._pool and self._jobs_on_pool >= self.recycle_after:
+                self._retire_pool()
+            else:
+                self._release_pool_if_idle(pool)
+
+    def stats(self):
+        return {"workers": self.workers, "running": self._running, "waiting": self._waiting}
+
+    def close(self):
+        """Shuts down every worker pool."""
+        self._retire_pool()
+        for pool in list(self._inflight):
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._inflight.clear()
+        for pids in self._worker_pids.values():
+            pids.close()
+        self._worker_pids.clear()
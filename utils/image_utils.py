@@ -1,128 +1,417 @@
 import io
+import functools
+import time
 import textwrap
-from PIL import Image, ImageDraw, ImageFont, ImageSequence
+from collections import namedtuple
+from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageSequence, GifImagePlugin
 
-def get_font(size):
-    font_paths = [
-        "utils/fonts/OpenSans-Bold.ttf",
-        "utils/fonts/OpenSans-Regular.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-        "/usr/share/fonts/truetype/freefont/FreeSansBold.ttf",
-        "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
-        "arialbd.ttf", # Arial Bold
-        "arial.ttf"
-    ]
-    for path in font_paths:
+# Fonts to try for captions, in order of preference.
+FONT_PATHS = [
+    "utils/fonts/OpenSans-Bold.ttf",
+    "utils/fonts/OpenSans-Regular.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/truetype/freefont/FreeSansBold.ttf",
+    "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
+    "arialbd.ttf", # Arial Bold
+    "arial.ttf"
+]
+
+# Sample used to estimate the average character width when wrapping.
+WIDTH_SAMPLE = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+# --- Font Registry ---
+# Caches live per process, so each image worker resolves and opens fonts once.
+
+@functools.lru_cache(maxsize=None)
+def resolve_font_path():
+    """Returns the first caption font that FreeType can open, or None."""
+    for path in FONT_PATHS:
         try:
-            return ImageFont.truetype(path, size)
+            ImageFont.truetype(path, 12)
+            return path
         except IOError:
             continue
-    return ImageFont.load_default()
+    return None
 
-def add_caption_to_image(image_bytes, text, is_animated_image=False, multiplier=1.0):
-    try:
-        img = Image.open(io.BytesIO(image_bytes))
-    except IOError:
+@functools.lru_cache(maxsize=128)
+def load_font(path, size):
+    """Opens a TrueType font at a given size, memoized per (path, size)."""
+    return ImageFont.truetype(path, size)
+
+def get_font(size):
+    path = resolve_font_path()
+    if path is None:
+        return ImageFont.load_default()
+    return load_font(path, size)
+
+@functools.lru_cache(maxsize=256)
+def get_avg_char_width(size):
+    """Returns the average character width of the caption font at a given size."""
+    font = get_font(size)
+    return (font.getlength(WIDTH_SAMPLE) / len(WIDTH_SAMPLE)) or 1
+
+# --- Decoding ---
+
+# JPEGs larger than this on their long side are decoded at a reduced scale.
+MAX_DECODE_SIDE = 4096
+
+def open_image(image_bytes, max_side=MAX_DECODE_SIDE):
+    """Opens an image for processing, using JPEG draft mode to skip decoding detail that won't be kept."""
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.format == 'JPEG' and max(img.size) > max_side:
+        ratio = max_side / max(img.size)
+        # Draft picks the smallest DCT scale that is still at least this size.
+        img.draft('RGB', (int(img.width * ratio), int(img.height * ratio)))
+    return img
+
+# --- Caption Layout ---
+
+# Result of solve_caption_layout. `probes` counts the wrap-and-measure passes it took.
+CaptionLayout = namedtuple("CaptionLayout", ["font", "font_size", "lines", "wrapped_text", "bbox", "probes"])
+
+MIN_CAPTION_FONT_SIZE = 10
+
+def _measure_caption(draw, text, font_size, drawable_width):
+    """Wraps text for a font size. Returns (wrapped_text, bbox), or None if it can't be wrapped."""
+    wrap_width = int(drawable_width / get_avg_char_width(font_size))
+    if wrap_width <= 1:
         return None
+    wrapper = textwrap.TextWrapper(width=wrap_width, break_long_words=True)
+    wrapped_text = wrapper.fill(text=text)
+    bbox = draw.multiline_textbbox((0, 0), wrapped_text, font=get_font(font_size), align="center")
+    return wrapped_text, bbox
 
-    # --- Dynamic Font Size & Wrapping ---
-    # Apply the multiplier to the initial font size calculation
-    font_size = int((img.width / 10) * multiplier)
-    padding = int(img.width * 0.04) # 4% padding on each side
-    drawable_width = img.width - (2 * padding)
-
-    while font_size > 10: # Don't let the font get too small
-        font = get_font(font_size)
-        
-        alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
-        avg_char_width = font.getlength(alphabet) / len(alphabet)
-        if avg_char_width == 0: avg_char_width = 1
-
-        wrap_width = int(drawable_width / avg_char_width)
-        if wrap_width <= 1:
-            font_size -= 2
-            continue
+def solve_caption_layout(text, image_width, multiplier=1.0):
+    """Finds the largest font size whose wrapped caption fits inside the image width.
+
+    Sizes from MIN_CAPTION_FONT_SIZE up to image_width / 10 * multiplier are
+    bisected after the starting size is tried, so a layout takes at most
+    O(log n) measuring passes. If nothing fits,
+    the minimum size is used anyway.
+    """
+    padding = int(image_width * 0.04) # 4% padding on each side
+    drawable_width = image_width - (2 * padding)
+    draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    measured = {}
 
-        wrapper = textwrap.TextWrapper(width=wrap_width, break_long_words=True)
-        wrapped_text = wrapper.fill(text=text)
+    def measure(size):
+        if size not in measured:
+            measured[size] = _measure_caption(draw, text, size, drawable_width)
+        return measured[size]
 
-        dummy_draw = ImageDraw.Draw(Image.new('RGBA', (1,1)))
-        text_bbox = dummy_draw.multiline_textbbox((0, 0), wrapped_text, font=font, align="center")
-        text_width = text_bbox[2] - text_bbox[0]
+    def fits(size):
+        result = measure(size)
+        return result is not None and result[1][2] - result[1][0] <= drawable_width
 
-        if text_width <= drawable_width:
-            break
+    low = MIN_CAPTION_FONT_SIZE
+    high = max(int((image_width / 10) * multiplier), low)
+    best = low
+    # Wrapping adapts to the font size, so the starting size usually fits as-is.
+    if fits(high):
+        best, low = high, high + 1
+    else:
+        high -= 1
+    while low <= high:
+        mid = (low + high) // 2
+        if fits(mid):
+            best = mid
+            low = mid + 1
         else:
-            font_size -= 2
+            high = mid - 1
+
+    result = measure(best)
+    if result is None:
+        # The image is too narrow to wrap at all; lay the caption out on one line.
+        wrapped_text = text
+        bbox = draw.multiline_textbbox((0, 0), text, font=get_font(best), align="center")
     else:
-        pass
+        wrapped_text, bbox = result
+    return CaptionLayout(get_font(best), best, wrapped_text.split("\n"), wrapped_text, bbox, len(measured))
 
-    # --- Calculate new height ---
+def render_caption_band(width, layout):
+    """Draws the caption text on a white band as wide as the image."""
+    text_bbox = layout.bbox
+    text_width = text_bbox[2] - text_bbox[0]
     text_height = text_bbox[3] - text_bbox[1]
-    caption_padding = int(font_size * 0.5)
+    caption_padding = int(layout.font_size * 0.5)
     caption_height = text_height + (2 * caption_padding)
 
+    band = Image.new("RGBA", (width, caption_height), "white")
+    draw = ImageDraw.Draw(band)
+    # Corrected centering logic
+    text_x = ((width - text_width) / 2) - text_bbox[0]
+    text_y = caption_padding
+    draw.multiline_text((text_x, text_y), layout.wrapped_text, font=layout.font, fill="black", align="center")
+    return band
+
+def _quantize_frame(frame, colors=256):
+    """Converts an RGBA frame to a palette image, returning (image, transparency index or None)."""
+    paletted = frame.convert("P", palette=Image.Palette.ADAPTIVE, colors=colors)
+    transparency = None
+    if paletted.palette.mode == "RGBA":
+        for rgba, index in paletted.palette.colors.items():
+            if rgba[3] == 0:
+                transparency = index
+                break
+    return paletted, transparency
+
+def _iter_captioned_frames(img, band):
+    """Yields (frame, offset, duration, disposal) for each captioned output frame.
+
+    The first frame is the band stacked on the first source frame. When its
+    disposal leaves it on screen, later frames are only the source frame
+    placed under the band; otherwise each frame is composited with the band
+    on a reused canvas.
+    """
+    caption_height = band.height
+    default_duration = img.info.get('duration', 100)
+    canvas = None
+    band_persists = True
+
+    for index, frame in enumerate(ImageSequence.Iterator(img)):
+        duration = frame.info.get('duration', default_duration)
+        disposal = getattr(img, 'disposal_method', 0)
+        frame = frame.convert("RGBA")
+
+        if index == 0:
+            band_persists = disposal in (0, 1)
+        if index > 0 and band_persists:
+            yield frame, (0, caption_height), duration, disposal
+            continue
+
+        if canvas is None:
+            canvas = Image.new("RGBA", (img.width, img.height + caption_height), "white")
+            canvas.paste(band, (0, 0))
+        canvas.paste(frame, (0, caption_height))
+        yield canvas, (0, 0), duration, disposal
+
+def _write_gif_stream(frames, output, loop=0, colors=256):
+    """Encodes (frame, offset, duration, disposal) tuples to output one frame at a time.
+
+    Each frame is quantized with its own local palette and written as soon
+    as it is produced, so only the current frame is ever held in memory.
+    """
+    wrote_header = False
+    for frame, offset, duration, disposal in frames:
+        paletted, transparency = _quantize_frame(frame, colors)
+        if not wrote_header:
+            header, _ = GifImagePlugin.getheader(paletted, None, {"loop": loop})
+            for chunk in header:
+                output.write(chunk)
+            wrote_header = True
+
+        params = {"include_color_table": True, "duration": duration, "disposal": disposal}
+        if transparency is not None:
+            params["transparency"] = transparency
+        for chunk in GifImagePlugin.getdata(paletted, offset, **params):
+            output.write(chunk)
+    output.write(b";")  # GIF trailer
+
+def add_caption_to_image(image_bytes, text, is_animated_image=False, multiplier=1.0):
+    try:
+        img = open_image(image_bytes)
+    except IOError:
+        return None
+
+    # --- Dynamic Font Size & Wrapping ---
+    layout = solve_caption_layout(text, img.width, multiplier)
+    # The band is rasterized once and reused for every frame.
+    band = render_caption_band(img.width, layout)
+
     if is_animated_image:
-        frames = []
-        duration = img.info.get('duration', 100)
-        loop = img.info.get('loop', 0)
-
-        for frame in ImageSequence.Iterator(img):
-            frame = frame.convert("RGBA")
-            
-            new_frame = Image.new("RGBA", (frame.width, frame.height + caption_height), "white")
-            new_frame.paste(frame, (0, caption_height))
-
-            draw = ImageDraw.Draw(new_frame)
-            # Corrected centering logic
-            text_x = ((img.width - text_width) / 2) - text_bbox[0]
-            text_y = caption_padding
-
-            draw.multiline_text((text_x, text_y), wrapped_text, font=font, fill="black", align="center")
-            
-            frames.append(new_frame)
-        
         output_buffer = io.BytesIO()
-        frames[0].save(output_buffer, format='GIF', save_all=True, append_images=frames[1:], loop=loop, duration=duration)
+        _write_gif_stream(_iter_captioned_frames(img, band), output_buffer, loop=img.info.get('loop', 0))
         return output_buffer.getvalue()
 
     else: # Static image
         img = img.convert("RGBA")
-        new_img = Image.new("RGBA", (img.width, img.height + caption_height), "white")
-        new_img.paste(img, (0, caption_height))
-
-        draw = ImageDraw.Draw(new_img)
-        # Corrected centering logic
-        text_x = ((img.width - text_width) / 2) - text_bbox[0]
-        text_y = caption_padding
-
-        draw.multiline_text((text_x, text_y), wrapped_text, font=font, fill="black", align="center")
+        new_img = Image.new("RGBA", (img.width, img.height + band.height), "white")
+        new_img.paste(band, (0, 0))
+        new_img.paste(img, (0, band.height))
 
         output_buffer = io.BytesIO()
         new_img.save(output_buffer, format='PNG')
         return output_buffer.getvalue()
 
+# --- GIF Conversion ---
+
+# Reductions tried in order when a GIF is over budget, mildest first:
+# (scale factor, palette size, keep every nth frame).
+GIF_FALLBACK_STEPS = [
+    (1.0, 128, 1),
+    (0.75, 128, 1),
+    (0.75, 64, 2),
+    (0.5, 64, 2),
+    (0.5, 32, 3),
+    (0.35, 32, 3),
+    (0.25, 32, 4),
+]
+
+def _iter_reduced_frames(img, scale, step):
+    """Yields (frame, offset, duration, disposal) for every `step`th frame, scaled by `scale`.
+
+    Dropped frames add their duration to the frame before them, so the
+    animation keeps its overall speed.
+    """
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    default_duration = img.info.get('duration', 100)
+    pending = None
+
+    for index, frame in enumerate(ImageSequence.Iterator(img)):
+        duration = frame.info.get('duration', default_duration)
+        if index % step and pending is not None:
+            pending[2] += duration
+            continue
+        if pending is not None:
+            yield tuple(pending)
+        frame = frame.convert("RGBA")
+        if size != frame.size:
+            frame = frame.resize(size, Image.Resampling.LANCZOS)
+        pending = [frame, (0, 0), duration, getattr(img, 'disposal_method', 0)]
+    if pending is not None:
+        yield tuple(pending)
+
+def _encode_reduced_gif(img, scale, colors, step):
+    output_buffer = io.BytesIO()
+    _write_gif_stream(_iter_reduced_frames(img, scale, step), output_buffer, loop=img.info.get('loop', 0), colors=colors)
+    return output_buffer.getvalue()
+
+def _describe_tradeoffs(scale, colors, step):
+    tradeoffs = []
+    if scale < 1:
+        tradeoffs.append(f"scaled to {scale:.0%}")
+    if colors < 256:
+        tradeoffs.append(f"{colors} colors")
+    if step > 1:
+        tradeoffs.append(f"1 in {step} frames kept" if step > 2 else "every other frame kept")
+    return tradeoffs
+
 def convert_to_gif(media_bytes, max_size_bytes):
-    """Converts an image into a GIF, respecting size limits."""
+    """Converts an image into a GIF that fits in max_size_bytes.
+
+    If the plain conversion is too large, the steps in GIF_FALLBACK_STEPS are
+    tried until one fits. Steps whose estimated size (scaled from the last
+    attempt by area and frame count) is still well over budget are skipped.
+    Returns (gif_bytes, error_message, tradeoffs), where tradeoffs lists what
+    was reduced to make the GIF fit.
+    """
     try:
-        img = Image.open(io.BytesIO(media_bytes))
+        img = open_image(media_bytes)
+        is_animated = getattr(img, 'is_animated', False)
 
-        # If it's already a GIF, just check the size and return it
-        if hasattr(img, 'is_animated') and img.is_animated:
-            if len(media_bytes) > max_size_bytes:
-                return None, f"The source GIF is too large (>{max_size_bytes / 1024 / 1024:.1f}MB)."
-            return media_bytes, None
+        # An animated GIF that already fits is returned untouched.
+        if is_animated and img.format == 'GIF' and len(media_bytes) <= max_size_bytes:
+            return media_bytes, None, []
 
-        output_buffer = io.BytesIO()
-        img.save(output_buffer, format='GIF')
-        gif_bytes = output_buffer.getvalue()
+        if is_animated:
+            gif_bytes = _encode_reduced_gif(img, 1.0, 256, 1)
+        else:
+            output_buffer = io.BytesIO()
+            img.save(output_buffer, format='GIF')
+            gif_bytes = output_buffer.getvalue()
+        if len(gif_bytes) <= max_size_bytes:
+            return gif_bytes, None, []
+
+        last_size, last_scale, last_step = len(gif_bytes), 1.0, 1
+        steps = GIF_FALLBACK_STEPS
+        if not is_animated:
+            steps = [(scale, colors, 1) for scale, colors, _ in GIF_FALLBACK_STEPS]
+        for index, (scale, colors, step) in enumerate(steps):
+            estimate = last_size * (scale / last_scale) ** 2 * (last_step / step)
+            if estimate > max_size_bytes * 1.25 and index < len(steps) - 1:
+                continue
 
-        if len(gif_bytes) > max_size_bytes:
-            return None, f"The resulting GIF is too large (>{max_size_bytes / 1024 / 1024:.1f}MB)."
+            gif_bytes = _encode_reduced_gif(img, scale, colors, step)
+            if len(gif_bytes) <= max_size_bytes:
+                return gif_bytes, None, _describe_tradeoffs(scale, colors, step)
+            last_size, last_scale, last_step = len(gif_bytes), scale, step
 
-        return gif_bytes, None
+        return None, f"The GIF is too large even after shrinking it (>{max_size_bytes / 1024 / 1024:.1f}MB).", []
     except IOError:
-        return None, "Could not process the image. It might be an unsupported format."
\ No newline at end of file
+        return None, "Could not process the image. It might be an unsupported format.", []
+
+# --- Profile Cards ---
+
+CARD_SIZE = (800, 300)
+AVATAR_SIZE = (150, 150)
+
+def prepare_profile_background(image_bytes):
+    """Turns an uploaded background into a ready-to-paste card base. Safe to run in a worker process.
+
+    The image is decoded once, center-cropped and scaled to CARD_SIZE, darkened
+    with the card overlay and returned as JPEG bytes.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft('RGB', CARD_SIZE)  # Lets large JPEGs decode at a reduced scale
+    base = ImageOps.fit(img.convert('RGBA'), CARD_SIZE, method=Image.Resampling.LANCZOS)
+    overlay = Image.new('RGBA', base.size, (0, 0, 0, 128))
+    base.paste(overlay, (0, 0), overlay)
+
+    output_buffer = io.BytesIO()
+    base.convert('RGB').save(output_buffer, format='JPEG', quality=90, optimize=True)
+    return output_buffer.getvalue()
+
+def prepare_avatar(avatar_bytes):
+    """Scales an avatar to AVATAR_SIZE and cuts it into a circle. Safe to run in a worker process.
+
+    Returns PNG bytes whose alpha channel is the circular mask.
+    """
+    avatar = Image.open(io.BytesIO(avatar_bytes)).convert('RGBA').resize(AVATAR_SIZE)
+    mask = Image.new('L', avatar.size, 0)
+    draw_mask = ImageDraw.Draw(mask)
+    draw_mask.ellipse((0, 0) + avatar.size, fill=255)
+    avatar.putalpha(mask)
+
+    output_buffer = io.BytesIO()
+    avatar.save(output_buffer, format='PNG')
+    return output_buffer.getvalue()
+
+def render_profile_card(background_bytes, avatar_bytes, display_name, profile_data, trivia_wins, hangman_wins):
+    """Composites a profile card. Safe to run in a worker process.
+
+    `background_bytes` is a base made by prepare_profile_background and
+    `avatar_bytes` a circle made by prepare_avatar. Returns
+    (png_bytes, timings) where timings holds the compose and encode
+    durations in milliseconds.
+    """
+    start = time.perf_counter()
+    card = Image.open(io.BytesIO(background_bytes)).convert('RGBA')
+
+    # Avatar, already masked by prepare_avatar
+    avatar = Image.open(io.BytesIO(avatar_bytes)).convert('RGBA')
+    card.paste(avatar, (50, 75), avatar)
+
+    # Text
+    draw = ImageDraw.Draw(card)
+    font_bold = load_font('utils/fonts/OpenSans-Bold.ttf', 36)
+    font_regular = load_font('utils/fonts/OpenSans-Regular.ttf', 24)
+
+    user_color = profile_data.get('color', '#ffffff')
+    draw.text((240, 100), display_name, font=font_bold, fill=user_color)
+    draw.text((240, 150), profile_data.get('description', 'No description.'), font=font_regular, fill=(220, 220, 220))
+
+    # Stats & Badges
+    rep = profile_data.get('reputation', 0)
+    stats_text = f"Rep: {rep} | Trivia Wins: {trivia_wins} | Hangman Wins: {hangman_wins}"
+    draw.text((240, 200), stats_text, font=font_regular, fill=(220, 220, 220))
+
+    badge_x = 240
+    if trivia_wins >= 5:
+        # In a real scenario, you'd load a badge image. For now, we'll draw a placeholder.
+        draw.rectangle((badge_x, 240, badge_x + 30, 270), fill=('gold'))
+        draw.text((badge_x + 5, 245), "T", font=font_regular, fill=('black'))
+        badge_x += 40
+    if hangman_wins >= 5:
+        draw.rectangle((badge_x, 240, badge_x + 30, 270), fill=('silver'))
+        draw.text((badge_x + 5, 245), "H", font=font_regular, fill=('black'))
+    composed = time.perf_counter()
+
+    output_buffer = io.BytesIO()
+    card.save(output_buffer, format='PNG')
+    encoded = time.perf_counter()
+
+    timings = {"compose": (composed - start) * 1000, "encode": (encoded - composed) * 1000}
+    return output_buffer.getvalue(), timings
@@ -0,0 +1,196 @@
+import asyncio
+import io
+import time
+from collections import namedtuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import aiohttp
+import discord
+from PIL import Image
+
+from utils.cache import LRUCache
+
+CHUNK_SIZE = 64 * 1024
+
+# What inspect_image() learned from an image's header.
+MediaInfo = namedtuple("MediaInfo", ["format", "width", "height", "frames", "is_animated"])
+
+# A piece of media found on a message by MediaResolver. `kind` is "image",
+# "video" or another MIME major type; size, width and height may be None.
+MediaSource = namedtuple("MediaSource", [
+    "url", "proxy_url", "kind", "content_type", "filename", "size", "width", "height", "is_animated"
+])
+
+
+class MediaError(Exception):
+    """Raised when media can't be fetched or is rejected. The message is safe to show users."""
+
+
+class MediaTooLargeError(MediaError):
+    """Raised when media goes over a byte, pixel or frame limit."""
+
+
+def inspect_image(data, max_pixels, max_frames):
+    """Checks an image's dimensions and frame count from its header, without decoding the pixels.
+
+    Returns MediaInfo, or raises MediaError if the image is unreadable or too big.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+            if width * height > max_pixels:
+                raise MediaTooLargeError(f"The image is too large to process ({width}x{height}).")
+            # Counting GIF frames seeks through the file without decoding them.
+            frames = getattr(img, 'n_frames', 1)
+            if frames > max_frames:
+                raise MediaTooLargeError(f"The animation has too many frames to process (over {max_frames}).")
+            return MediaInfo(img.format, width, height, frames, frames > 1)
+    except Image.DecompressionBombError:
+        raise MediaTooLargeError("The image is too large to process.")
+    except (IOError, SyntaxError):
+        raise MediaError("Could not read the image. It might be an unsupported format.")
+
+
+def sized_variant_url(url, proxy_url, width, height, max_side, content_type=None):
+    """Returns a media proxy URL for a copy of an image scaled to fit max_side, or `url` if that won't help.
+
+    Discord's media proxy resizes images when given width and height query
+    parameters. Images that already fit, or whose size isn't known, are
+    fetched as-is. GIFs are too, since the proxy would drop their animation.
+    """
+    if not proxy_url or not width or not height or max(width, height) <= max_side:
+        return url
+    if content_type == 'image/gif' or urlsplit(url).path.lower().endswith('.gif'):
+        return url
+
+    ratio = max_side / max(width, height)
+    parts = urlsplit(proxy_url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k not in ('width', 'height')]
+    query += [('width', str(max(1, round(width * ratio)))), ('height', str(max(1, round(height * ratio))))]
+    return parts._replace(query=urlencode(query)).geturl()
+
+
+class MediaFetcher:
+    """Downloads user media with hard limits, for the image and profile cogs.
+
+    Bodies are streamed into a buffer that is abandoned as soon as it passes
+    `max_bytes`, whatever Content-Length claimed. Images are then checked by
+    inspect_image() before any worker spends time decoding them.
+    """
+
+    def __init__(self, http_client, max_bytes, max_pixels, max_frames, timeout=30.0):
+        self.http_client = http_client
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.max_frames = max_frames
+        self.timeout = timeout
+
+    async def fetch(self, url, max_bytes=None):
+        """Downloads url and returns its bytes, raising MediaError if it fails or is too large."""
+        limit = max_bytes or self.max_bytes
+        try:
+            async with self.http_client.get(url, timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+                if resp.status != 200:
+                    raise MediaError("Could not download the file.")
+                if resp.content_length is not None and resp.content_length > limit:
+                    raise MediaTooLargeError(f"The file is too large (must be under {limit / 1024 / 1024:.1f}MB).")
+
+                buffer = bytearray()
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    buffer += chunk
+                    if len(buffer) > limit:
+                        raise MediaTooLargeError(f"The file is too large (must be under {limit / 1024 / 1024:.1f}MB).")
+                return bytes(buffer)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise MediaError("Could not download the file.")
+
+    async def fetch_image(self, url, max_bytes=None):
+        """Downloads and inspects an image. Returns (bytes, MediaInfo)."""
+        data = await self.fetch(url, max_bytes)
+        loop = asyncio.get_running_loop()
+        info = await loop.run_in_executor(None, inspect_image, data, self.max_pixels, self.max_frames)
+        return data, info
+
+
+def _attachment_source(attachment):
+    content_type = attachment.content_type or ""
+    kind = content_type.split("/")[0] if content_type else "image"
+    is_animated = content_type == "image/gif" or attachment.filename.lower().endswith(".gif")
+    return MediaSource(
+        attachment.url, attachment.proxy_url, kind, attachment.content_type, attachment.filename,
+        attachment.size, attachment.width, attachment.height, is_animated
+    )
+
+def _embed_source(embed, prefer_image=False):
+    video = None
+    if embed.video and embed.video.url:
+        video = MediaSource(embed.video.url, embed.video.proxy_url, "video", None, None, None,
+                            embed.video.width, embed.video.height, True)
+        if not prefer_image:
+            return video
+    for media in (embed.image, embed.thumbnail):
+        if media and media.url:
+            is_animated = urlsplit(media.url).path.lower().endswith(".gif")
+            return MediaSource(media.url, media.proxy_url, "image", None, None, None,
+                               media.width, media.height, is_animated)
+    return video
+
+def find_media(message, prefer_image=False):
+    """Returns a MediaSource for the first attachment or embed media on a message, or None.
+
+    With prefer_image, embeds that carry both a video and a still (e.g. Tenor
+    or GIPHY gifv links) resolve to the still image instead of the video.
+    """
+    if message.attachments:
+        return _attachment_source(message.attachments[0])
+    for embed in message.embeds:
+        source = _embed_source(embed, prefer_image)
+        if source is not None:
+            return source
+    return None
+
+
+class MediaResolver:
+    """Finds the media a command should work on: the invoking message's attachment, or the message it replies to.
+
+    Replied-to messages are taken from the reference Discord already
+    resolved, then the client's message cache, and only fetched over REST
+    as a last resort. Media found on a replied-to message is remembered by
+    message id for `max_age` seconds (attachment URLs are signed and expire),
+    so repeated replies to the same image cost no API calls.
+    """
+
+    def __init__(self, cache_size=256, max_age=3600.0):
+        self._cache = LRUCache(cache_size, sizeof=lambda _: 1)  # {(message_id, prefer_image): (found_at, source)}
+        self.max_age = max_age
+        self.rest_fetches = 0
+
+    async def resolve(self, message, prefer_image=False):
+        """Returns a MediaSource, or None if neither the message nor its reply target has media.
+
+        prefer_image is passed on to find_media.
+        """
+        if message.attachments:
+            return _attachment_source(message.attachments[0])
+        reference = message.reference
+        if reference is None or reference.message_id is None:
+            return None
+
+        cache_key = (reference.message_id, prefer_image)
+        cached = self._cache.get(cache_key)
+        if cached is not None and time.monotonic() - cached[0] < self.max_age:
+            return cached[1]
+
+        target = reference.resolved if isinstance(reference.resolved, discord.Message) else reference.cached_message
+        if target is None:
+            try:
+                target = await message.channel.fetch_message(reference.message_id)
+            except discord.HTTPException:
+                return None
+            self.rest_fetches += 1
+
+        # Messages without media aren't cached, since link embeds can be added after posting.
+        source = find_media(target, prefer_image)
+        if source is not None:
+            self._cache.put(cache_key, (time.monotonic(), source))
+        return source
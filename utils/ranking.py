@@ -0,0 +1,57 @@
+from sortedcontainers import SortedList
+
+
+class LeaderboardIndex:
+    """Keeps every (guild, game) leaderboard ordered by score.
+
+    Entries are stored as (-score, user_id) in a SortedList, so updates,
+    top-N slices and rank lookups are all logarithmic instead of sorting the
+    whole guild on each query.
+    """
+
+    def __init__(self):
+        self._boards = {}  # {(guild_id, game): SortedList[(-score, user_id)]}
+        self._scores = {}  # {(guild_id, game): {user_id: score}}
+
+    @classmethod
+    def from_leaderboard(cls, leaderboard, games):
+        """Builds an index from {guild_id: {user_id: {"<game>_wins": n}}}."""
+        index = cls()
+        for gid, users in leaderboard.items():
+            for game in games:
+                key = f"{game}_wins"
+                scores = {uid: user_scores.get(key, 0) for uid, user_scores in users.items()}
+                index._scores[(gid, game)] = scores
+                index._boards[(gid, game)] = SortedList((-score, uid) for uid, score in scores.items())
+        return index
+
+    def update(self, guild_id, user_id, game, score):
+        """Sets a user's score for a game."""
+        board_key = (str(guild_id), game)
+        uid = str(user_id)
+        scores = self._scores.setdefault(board_key, {})
+        board = self._boards.setdefault(board_key, SortedList())
+        if uid in scores:
+            board.remove((-scores[uid], uid))
+        scores[uid] = score
+        board.add((-score, uid))
+
+    def top(self, guild_id, game, n=10):
+        """Returns the n highest [(user_id, score)] for a game."""
+        board = self._boards.get((str(guild_id), game))
+        if not board:
+            return []
+        return [(uid, -neg_score) for neg_score, uid in board.islice(0, n)]
+
+    def rank(self, guild_id, game, user_id):
+        """Returns (rank, total_players) for a user, or None if they aren't on the board.
+
+        Users with equal scores share a rank.
+        """
+        board_key = (str(guild_id), game)
+        score = self._scores.get(board_key, {}).get(str(user_id))
+        if score is None:
+            return None
+        board = self._boards[board_key]
+        # "" sorts before every user ID, so this counts users with a strictly higher score.
+        return board.bisect_left((-score, "")) + 1, len(board)
@@ -0,0 +1,105 @@
+import json
+import logging
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from utils.cache import LRUCache
+
+# Rough cost of an entry beyond its JSON body (key, tuple, timestamps), so cached 404s count too.
+ENTRY_OVERHEAD = 128
+
+
+def normalize_url(url, params=None):
+    """Returns a canonical form of url plus params, so equivalent requests share a cache key.
+
+    The scheme and host are lower-cased, the fragment is dropped, and query
+    parameters (from the URL and `params`) are sorted.
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query += [(str(k), str(v)) for k, v in params.items()]
+    return parts._replace(
+        scheme=parts.scheme.lower(),
+        netloc=parts.netloc.lower(),
+        query=urlencode(sorted(query)),
+        fragment="",
+    ).geturl()
+
+
+def _entry_size(key, body):
+    return len(key) + len(body or "") + ENTRY_OVERHEAD
+
+
+def _decode(body):
+    return json.loads(body) if body is not None else None
+
+
+class ResponseCache:
+    """Caches decoded JSON API responses for a per-host time to live.
+
+    200 responses are kept for `ttls[host]` seconds (or `default_ttl`), and
+    404s for `negative_ttl`, so repeated lookups of missing words or shows
+    don't go upstream either. The memory tier is an LRU bounded by the size
+    of the key and JSON plus a fixed per-entry overhead. Entries are kept as
+    JSON text and decoded on every hit, so callers can't change each other's
+    (or the cache's) copy. If `storage` is given, entries are also written
+    to its response_cache table and survive restarts.
+    """
+
+    def __init__(self, memory_bytes, default_ttl=3600.0, ttls=None, negative_ttl=600.0, storage=None):
+        self._memory = LRUCache(memory_bytes, sizeof=lambda entry: entry[3])  # {key: (expires_at, status, body, size)}
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.negative_ttl = negative_ttl
+        self.storage = storage
+        self.persistent_hits = 0
+
+    def ttl_for(self, url, status):
+        if status == 404:
+            return self.negative_ttl
+        return self.ttls.get(urlsplit(url).hostname, self.default_ttl)
+
+    async def get(self, key):
+        """Returns (True, data) for a live entry, where data is None for a cached 404, or (False, None)."""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                return True, _decode(entry[2])
+            self._memory.pop(key)
+
+        if self.storage is None:
+            return False, None
+        try:
+            row = await self.storage.get_cached_response(key, now)
+        except Exception as e:
+            logging.error(f"[ResponseCache] Persistent lookup failed: {e}")
+            return False, None
+        if row is None:
+            return False, None
+        expires_at, status, body = row
+        self.persistent_hits += 1
+        self._memory.put(key, (expires_at, status, body, _entry_size(key, body)))
+        return True, _decode(body)
+
+    async def put(self, key, url, status, data):
+        """Caches a 200 response's decoded JSON, or a 404 (with data None). Other statuses are ignored."""
+        if status not in (200, 404):
+            return
+        ttl = self.ttl_for(url, status)
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        body = json.dumps(data) if status == 200 else None
+        self._memory.put(key, (expires_at, status, body, _entry_size(key, body)))
+        if self.storage is not None:
+            try:
+                await self.storage.put_cached_response(key, expires_at, status, body)
+            except Exception as e:
+                logging.error(f"[ResponseCache] Persistent write failed: {e}")
+
+    def stats(self):
+        stats = self._memory.stats()
+        stats["persistent_hits"] = self.persistent_hits
+        return stats
@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from utils.cache import LRUCache
+from utils.storage import atomic_write
+
+
+def make_key(data, operation, **params):
+    """Returns a content-addressed key for an operation applied to some input bytes."""
+    digest = hashlib.sha256(data)
+    digest.update(operation.encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory, then disk) cache of processed image results.
+
+    Entries are (bytes, metadata) pairs keyed by make_key(). Both tiers are
+    bounded by total size and evict the least recently used entries. Disk
+    I/O runs in the default executor, including the scan that builds the
+    disk index on first use.
+    """
+
+    def __init__(self, memory_bytes, disk_dir, disk_bytes):
+        self._memory = LRUCache(memory_bytes, sizeof=lambda entry: len(entry[0]))
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._disk_index = OrderedDict()  # {key: size}, least recently used first
+        self._disk_used = 0
+        self._index_loaded = False
+        self._index_future = None
+        self.disk_hits = 0
+
+    def _scan_disk(self):
+        """Returns [(key, size)] for complete entries, oldest first, removing leftovers of interrupted writes."""
+        try:
+            names = set(os.listdir(self.disk_dir))
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            path = os.path.join(self.disk_dir, name)
+            key, ext = os.path.splitext(name)
+            complete = (ext == '.bin' and f"{key}.json" in names) or (ext == '.json' and f"{key}.bin" in names)
+            try:
+                if not complete:
+                    # Temp files from atomic_write, or a data file without its metadata (or vice versa).
+                    os.remove(path)
+                elif ext == '.bin':
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, key, stat.st_size))
+            except OSError as e:
+                logging.warning(f"[ImageCache] Could not index {path}: {e}")
+        return [(key, size) for _, key, size in sorted(entries)]
+
+    async def _ensure_disk_index(self):
+        if self._index_loaded:
+            return
+        if self._index_future is None:
+            self._index_future = asyncio.get_running_loop().run_in_executor(None, self._scan_disk)
+        entries = await asyncio.shield(self._index_future)
+        if not self._index_loaded:
+            self._index_loaded = True
+            for key, size in entries:
+                self._disk_index[key] = size
+                self._disk_used += size
+
+    def _paths(self, key):
+        base = os.path.join(self.disk_dir, key)
+        return f"{base}.bin", f"{base}.json"
+
+    def _read_disk(self, key):
+        data_path, meta_path = self._paths(key)
+        with open(data_path, 'rb') as f:
+            data = f.read()
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        os.utime(data_path)  # Keeps recency across restarts
+        return data, meta
+
+    def _write_disk(self, key, data, meta, evicted):
+        data_path, meta_path = self._paths(key)
+        atomic_write(meta_path, json.dumps(meta))
+        atomic_write(data_path, data)
+        for old_key in evicted:
+            for path in self._paths(old_key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    async def get(self, key):
+        """Returns (data, metadata) for a key, or None."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            return entry
+        await self._ensure_disk_index()
+        if key not in self._disk_index:
+            return None
+
+        loop = asyncio.get_running_loop()
+        try:
+            entry = await loop.run_in_executor(None, self._read_disk, key)
+        except (OSError, json.JSONDecodeError):
+            self._disk_used -= self._disk_index.pop(key, 0)
+            return None
+        self._disk_index.move_to_end(key)
+        self.disk_hits += 1
+        self._memory.put(key, entry)
+        return entry
+
+    async def put(self, key, data, meta):
+        """Stores a result in both tiers."""
+        self._memory.put(key, (data, meta))
+        if len(data) > self.disk_bytes:
+            return
+
+        await self._ensure_disk_index()
+        self._disk_used -= self._disk_index.pop(key, 0)
+        self._disk_index[key] = len(data)
+        self._disk_used += len(data)
+        evicted = []
+        while self._disk_used > self.disk_bytes:
+            old_key, old_size = self._disk_index.popitem(last=False)
+            self._disk_used -= old_size
+            evicted.append(old_key)
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_disk, key, data, meta, evicted)
+        except OSError as e:
+            logging.error(f"Could not write image cache entry {key}: {e}")
+            self._disk_used -= self._disk_index.pop(key, 0)
+
+    def stats(self):
+        stats = self._memory.stats()
+        # Memory misses that were then found on disk count as hits overall.
+        lookups = stats["hits"] + stats["misses"]
+        stats["disk_hits"] = self.disk_hits
+        stats["disk_entries"] = len(self._disk_index)
+        stats["disk_bytes"] = self._disk_used
+        stats["overall_hit_ratio"] = (stats["hits"] + self.disk_hits) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,41 @@
+import asyncio
+import copy
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one in-flight task.
+
+    The first caller for a key starts `func(*args)`; callers arriving while
+    it runs await the same task and get the same result or exception. Each
+    caller waits through asyncio.shield, so cancelling one caller (say, a
+    command that timed out) doesn't cancel the request for everyone else.
+    Each caller gets its own deep copy of the result, so one caller mutating
+    it can't affect another. The key is forgotten as soon as the task
+    finishes, so nothing is cached.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # {key: task}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key, func, *args):
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every caller was cancelled.
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._inflight)}
@@ -0,0 +1,367 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_DB_PATH = "servers/bot.db"
+
+# Legacy whole-file JSON stores that are imported into the database on first start.
+LEGACY_FILES = {
+    "settings": "servers/settings.json",
+    "leaderboard": "servers/leaderboard.json",
+    "surveys": "servers/surveys.json",
+}
+
+# Maps a game name to its column in the leaderboard table.
+GAME_COLUMNS = {
+    "trivia": "trivia_wins",
+    "hangman": "hangman_wins",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leaderboard (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    trivia_wins INTEGER NOT NULL DEFAULT 0,
+    hangman_wins INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS score_journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    game TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS score_journal_member ON score_journal (guild_id, user_id, game);
+CREATE TABLE IF NOT EXISTS surveys (
+    guild_id TEXT NOT NULL,
+    survey_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (guild_id, survey_id)
+);
+CREATE TABLE IF NOT EXISTS response_cache (
+    key TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    status INTEGER NOT NULL,
+    body TEXT
+);
+"""
+
+
+def atomic_write(path, data):
+    """Writes bytes or text to `path` via a temp file and os.replace, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    with open(tmp_path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Storage:
+    """SQLite (WAL mode) store for settings, leaderboard, surveys and cached API responses.
+
+    Every query runs on a single dedicated thread, so callers simply await the
+    public coroutines and the event loop never blocks on disk I/O. Writes are
+    row-level upserts, so their cost depends on the size of the change rather
+    than the size of the dataset.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self._conn = None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # --- Lifecycle --- #
+    async def open(self):
+        """Opens the database, creating tables and importing legacy JSON files."""
+        await self._run(self._open)
+
+    async def close(self):
+        """Closes the database and stops the worker thread."""
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._import_legacy_files()
+
+    def _import_legacy_files(self):
+        importers = {
+            "settings": self._import_settings,
+            "leaderboard": self._import_leaderboard,
+            "surveys": self._import_surveys,
+        }
+        for name, path in LEGACY_FILES.items():
+            meta_key = f"imported:{name}"
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = ?", (meta_key,)).fetchone():
+                continue
+
+            data = {}
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r') as f:
+                        data = json.load(f)
+                except json.JSONDecodeError:
+                    logging.warning(f"Legacy file '{path}' is empty or malformed, skipping import.")
+
+            with self._conn:
+                if isinstance(data, dict) and data:
+                    importers[name](data)
+                    logging.info(f"Imported '{path}' into {self.path}.")
+                self._conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (meta_key, path))
+
+    def _import_settings(self, data):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO guild_settings (guild_id, data) VALUES (?, ?)",
+            [(str(gid), json.dumps(settings)) for gid, settings in data.items()]
+        )
+
+    def _import_leaderboard(self, data):
+        rows = []
+        for gid, users in data.items():
+            for uid, scores in users.items():
+                rows.append((str(gid), str(uid), scores.get("trivia_wins", 0), scores.get("hangman_wins", 0)))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO leaderboard (guild_id, user_id, trivia_wins, hangman_wins) VALUES (?, ?, ?, ?)",
+            rows
+        )
+
+    def _import_surveys(self, data):
+        rows = []
+        for gid, surveys in data.items():
+            for survey_id, survey in surveys.items():
+                rows.append((str(gid), str(survey_id), json.dumps(survey)))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO surveys (guild_id, survey_id, data) VALUES (?, ?, ?)",
+            rows
+        )
+
+    # --- Settings --- #
+    async def load_settings(self):
+        """Returns all guild settings as {guild_id: settings}."""
+        return await self._run(self._load_settings)
+
+    def _load_settings(self):
+        rows = self._conn.execute("SELECT guild_id, data FROM guild_settings").fetchall()
+        return {gid: json.loads(data) for gid, data in rows}
+
+    async def save_guild_settings(self, settings_by_guild):
+        """Upserts the settings rows for several guilds in one transaction."""
+        # Serialized on the storage thread so a large flush doesn't block the event loop.
+        await self._run(self._save_guild_settings, dict(settings_by_guild))
+
+    def _save_guild_settings(self, settings_by_guild):
+        rows = [(str(gid), json.dumps(settings)) for gid, settings in settings_by_guild.items()]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO guild_settings (guild_id, data) VALUES (?, ?) "
+                "ON CONFLICT(guild_id) DO UPDATE SET data = excluded.data",
+                rows
+            )
+
+    # --- Leaderboard --- #
+    # Wins are appended to score_journal and periodically folded into the
+    # leaderboard snapshot table by compact_journal(). Reads combine both.
+    async def load_leaderboard(self):
+        """Returns all scores as {guild_id: {user_id: {"trivia_wins": n, "hangman_wins": n}}}."""
+        return await self._run(self._load_leaderboard)
+
+    def _load_leaderboard(self):
+        leaderboard = {}
+        rows = self._conn.execute("SELECT guild_id, user_id, trivia_wins, hangman_wins FROM leaderboard")
+        for gid, uid, trivia_wins, hangman_wins in rows:
+            leaderboard.setdefault(gid, {})[uid] = {"trivia_wins": trivia_wins, "hangman_wins": hangman_wins}
+
+        # Replay the journal tail that hasn't been compacted yet.
+        rows = self._conn.execute("SELECT guild_id, user_id, game, COUNT(*) FROM score_journal GROUP BY guild_id, user_id, game")
+        for gid, uid, game, count in rows:
+            column = GAME_COLUMNS.get(game)
+            if column is None:
+                continue
+            scores = leaderboard.setdefault(gid, {}).setdefault(uid, {"trivia_wins": 0, "hangman_wins": 0})
+            scores[column] += count
+        return leaderboard
+
+    async def add_win(self, guild_id, user_id, game):
+        """Appends a win to the score journal."""
+        if game not in GAME_COLUMNS:
+            raise ValueError(f"Unknown game: {game}")
+        await self._run(self._add_win, str(guild_id), str(user_id), game)
+
+    def _add_win(self, guild_id, user_id, game):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO score_journal (guild_id, user_id, game) VALUES (?, ?, ?)",
+                (guild_id, user_id, game)
+            )
+
+    async def compact_journal(self):
+        """Folds the score journal into the leaderboard snapshot. Returns the number of records rolled up."""
+        return await self._run(self._compact_journal)
+
+    def _compact_journal(self):
+        with self._conn:
+            max_seq = self._conn.execute("SELECT MAX(seq) FROM score_journal").fetchone()[0]
+            if max_seq is None:
+                return 0
+            self._conn.execute(
+                "INSERT INTO leaderboard (guild_id, user_id, trivia_wins, hangman_wins) "
+                "SELECT guild_id, user_id, "
+                "SUM(CASE WHEN game = 'trivia' THEN 1 ELSE 0 END), "
+                "SUM(CASE WHEN game = 'hangman' THEN 1 ELSE 0 END) "
+                "FROM score_journal WHERE seq <= ? GROUP BY guild_id, user_id "
+                "ON CONFLICT(guild_id, user_id) DO UPDATE SET "
+                "trivia_wins = trivia_wins + excluded.trivia_wins, "
+                "hangman_wins = hangman_wins + excluded.hangman_wins",
+                (max_seq,)
+            )
+            return self._conn.execute("DELETE FROM score_journal WHERE seq <= ?", (max_seq,)).rowcount
+
+    async def get_scores(self, guild_id, user_id):
+        """Returns a single user's scores, or zeroes if they haven't played."""
+        return await self._run(self._get_scores, str(guild_id), str(user_id))
+
+    def _get_scores(self, guild_id, user_id):
+        scores = {"trivia_wins": 0, "hangman_wins": 0}
+        row = self._conn.execute(
+            "SELECT trivia_wins, hangman_wins FROM leaderboard WHERE guild_id = ? AND user_id = ?",
+            (guild_id, user_id)
+        ).fetchone()
+        if row:
+            scores = {"trivia_wins": row[0], "hangman_wins": row[1]}
+
+        rows = self._conn.execute(
+            "SELECT game, COUNT(*) FROM score_journal WHERE guild_id = ? AND user_id = ? GROUP BY game",
+            (guild_id, user_id)
+        )
+        for game, count in rows:
+            if game in GAME_COLUMNS:
+                scores[GAME_COLUMNS[game]] += count
+        return scores
+
+    # --- Surveys --- #
+    async def load_surveys(self):
+        """Returns all surveys as {guild_id: {survey_id: survey}}."""
+        return await self._run(self._load_surveys)
+
+    def _load_surveys(self):
+        surveys = {}
+        for gid, survey_id, data in self._conn.execute("SELECT guild_id, survey_id, data FROM surveys"):
+            surveys.setdefault(gid, {})[survey_id] = json.loads(data)
+        return surveys
+
+    async def save_survey(self, guild_id, survey_id, survey):
+        """Upserts a single survey row."""
+        await self._run(self._save_survey, str(guild_id), str(survey_id), json.dumps(survey))
+
+    def _save_survey(self, guild_id, survey_id, data):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO surveys (guild_id, survey_id, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(guild_id, survey_id) DO UPDATE SET data = excluded.data",
+                (guild_id, survey_id, data)
+            )
+
+    # --- Response Cache --- #
+    async def get_cached_response(self, key, now):
+        """Returns (expires_at, status, body) for an unexpired cached API response, or None."""
+        return await self._run(self._get_cached_response, key, now)
+
+    def _get_cached_response(self, key, now):
+        return self._conn.execute(
+            "SELECT expires_at, status, body FROM response_cache WHERE key = ? AND expires_at > ?",
+            (key, now)
+        ).fetchone()
+
+    async def put_cached_response(self, key, expires_at, status, body):
+        await self._run(self._put_cached_response, key, expires_at, status, body)
+
+    def _put_cached_response(self, key, expires_at, status, body):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO response_cache (key, expires_at, status, body) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at, status = excluded.status, body = excluded.body",
+                (key, expires_at, status, body)
+            )
+
+    async def purge_cached_responses(self, now):
+        """Deletes expired cached API responses. Returns how many were removed."""
+        return await self._run(self._purge_cached_responses, now)
+
+    def _purge_cached_responses(self, now):
+        with self._conn:
+            return self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,)).rowcount
+
+
+class WriteBehindFlusher:
+    """Coalesces writes for dirty keys and flushes them in one batch.
+
+    `mark_dirty` is cheap and synchronous. The first dirty key of a window
+    schedules a flush `delay` seconds later, and every key marked before it
+    runs is handed to `flush_func` together, so N edits in a window cost a
+    single write. Keys whose flush fails are retried in the next window.
+    """
+
+    def __init__(self, flush_func, delay=2.0):
+        self._flush_func = flush_func
+        self.delay = delay
+        self._dirty = set()
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def mark_dirty(self, key):
+        self._dirty.add(key)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._dirty:
+            await asyncio.sleep(self.delay)
+            await self.flush()
+
+    async def flush(self):
+        """Writes every dirty key now."""
+        async with self._lock:
+            if not self._dirty:
+                return
+            keys, self._dirty = self._dirty, set()
+            try:
+                await self._flush_func(keys)
+            except Exception as e:
+                logging.error(f"Write-behind flush of {len(keys)} key(s) failed: {e}")
+                self._dirty |= keys
+            except BaseException:
+                # Cancelled mid-write: keep the keys so a later flush still writes them.
+                self._dirty |= keys
+                raise
+
+    async def close(self):
+        """Cancels the pending window and flushes immediately."""
+        if self._task is not None and not self._task.done():
+            # Holding the lock means the task is between flushes, never mid-write.
+            async with self._lock:
+                self._task.cancel()
+        await self.flush()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from collections import deque
+
+OPENTDB_API_URL = "https://opentdb.com/api.php"
+OPENTDB_TOKEN_URL = "https://opentdb.com/api_token.php"
+OPENTDB_CATEGORY_URL = "https://opentdb.com/api_category.php"
+
+# OpenTDB response codes.
+RESPONSE_OK = 0
+RESPONSE_NO_RESULTS = 1
+RESPONSE_INVALID_PARAMETER = 2
+RESPONSE_TOKEN_NOT_FOUND = 3
+RESPONSE_TOKEN_EMPTY = 4
+RESPONSE_RATE_LIMIT = 5
+
+
+class TriviaBuffer:
+    """Prefetched OpenTDB questions, one queue per category (None for any category).
+
+    Questions are fetched `batch_size` at a time with a session token, so the
+    bot doesn't repeat a question until the category has been exhausted.
+    Taking a question that leaves `low_water` or fewer in the queue starts a
+    background refill, so in steady state a round never waits on the
+    network. The category list is fetched once and kept for the life of
+    the process. `fetch_json` is an async callable returning decoded JSON
+    or None; it must return the body of a 429 response too, since that's
+    where OpenTDB puts its rate limit response code. OpenTDB's one request
+    per 5 seconds is enforced by the opentdb.com host policy in
+    utils/upstream.py, not here.
+    """
+
+    def __init__(self, fetch_json, batch_size=20, low_water=5):
+        self._fetch_json = fetch_json
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self._queues = {}  # {category_id: deque of question dicts}
+        self._refills = {}  # {category_id: task}
+        self._token = None
+        self._categories = None
+
+    # --- Questions --- #
+    async def get_question(self, category_id=None):
+        """Returns the next question dict for a category, or None if none could be fetched."""
+        queue = self._queues.setdefault(category_id, deque())
+        if not queue:
+            # Cold start: wait for the first batch.
+            await asyncio.shield(self._schedule_refill(category_id))
+        if not queue:
+            if category_id is not None:
+                self._queues.pop(category_id, None)
+            return None
+
+        question = queue.popleft()
+        if len(queue) <= self.low_water:
+            self._schedule_refill(category_id)
+        return question
+
+    def prefetch(self, category_id=None):
+        """Starts filling a category's queue in the background."""
+        self._queues.setdefault(category_id, deque())
+        self._schedule_refill(category_id)
+
+    def _schedule_refill(self, category_id):
+        task = self._refills.get(category_id)
+        if task is None or task.done():
+            task = asyncio.get_running_loop().create_task(self._refill(category_id))
+            self._refills[category_id] = task
+        return task
+
+    async def _refill(self, category_id):
+        amount = self.batch_size
+        for _ in range(4):
+            token = await self._get_token()
+            params = {"amount": amount, "type": "multiple"}
+            if category_id is not None:
+                params["category"] = category_id
+            if token:
+                params["token"] = token
+            data = await self._request(OPENTDB_API_URL, params)
+            if not data:
+                return
+
+            code = data.get("response_code")
+            if code == RESPONSE_OK:
+                self._queues.setdefault(category_id, deque()).extend(data.get("results", []))
+                return
+            if code == RESPONSE_TOKEN_NOT_FOUND:
+                self._token = None
+            elif code == RESPONSE_TOKEN_EMPTY:
+                # Every question in the category has been served; start over.
+                await self._request(OPENTDB_TOKEN_URL, {"command": "reset", "token": token})
+            elif code == RESPONSE_NO_RESULTS and amount > 1:
+                amount = max(1, amount // 2)
+            elif code == RESPONSE_RATE_LIMIT:
+                continue  # The host policy spaces the retry out
+            else:
+                logging.warning(f"[Trivia] OpenTDB returned response code {code} for category {category_id}.")
+                return
+
+    async def _get_token(self):
+        if self._token is None:
+            data = await self._request(OPENTDB_TOKEN_URL, {"command": "request"})
+            if data and data.get("response_code") == RESPONSE_OK:
+                self._token = data.get("token")
+        return self._token
+
+    async def _request(self, url, params):
+        if params:
+            url += "?" + "&".join(f"{k}={v}" for k, v in params.items())
+        return await self._fetch_json(url)
+
+    # --- Categories --- #
+    async def get_categories(self):
+        """Returns the list of {"id", "name"} categories, fetched once per process."""
+        if self._categories is None:
+            data = await self._request(OPENTDB_CATEGORY_URL, {})
+            if data and data.get("trivia_categories"):
+                self._categories = data["trivia_categories"]
+        return self._categories
+
+    def is_known_category(self, category_id):
+        """False only when the category list is loaded and doesn't contain category_id."""
+        return self._categories is None or any(cat["id"] == category_id for cat in self._categories)
+
+    def close(self):
+        for task in self._refills.values():
+            task.cancel()
+        self._refills.clear()
+
+    def stats(self):
+        return {str(category_id): len(queue) for category_id, queue in self._queues.items()}
@@ -0,0 +1,319 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+
+import aiohttp
+
+# Statuses worth retrying; everything else (including 404) counts as a healthy answer.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Policy for hosts that aren't listed below. rate is requests per second (0 = unlimited).
+DEFAULT_POLICY = {
+    "rate": 0.0,
+    "burst": 10,
+    "max_concurrency": 10,
+    "max_retries": 1,
+    "max_wait": 10.0,
+    "failure_threshold": 5,
+    "reset_seconds": 30.0,
+    "timeout": None,  # seconds; None keeps the session's default timeout
+}
+
+# Known limits of the APIs the bot calls. Overridable with [upstream:<host>] sections.
+HOST_POLICIES = {
+    "opentdb.com": {"rate": 0.2, "burst": 1, "max_concurrency": 1},
+    "api.dictionaryapi.dev": {"rate": 5.0, "burst": 10, "max_concurrency": 4},
+    "api.tvmaze.com": {"rate": 2.0, "burst": 20, "max_concurrency": 4},
+    "en.wikipedia.org": {"rate": 10.0, "burst": 20},
+    "api.github.com": {"rate": 60 / 3600, "burst": 10, "max_concurrency": 2},
+    "api-inference.huggingface.co": {"max_concurrency": 2, "max_retries": 2, "timeout": 60.0},
+}
+
+POLICY_TYPES = {
+    "rate": float,
+    "burst": int,
+    "max_concurrency": int,
+    "max_retries": int,
+    "max_wait": float,
+    "failure_threshold": int,
+    "reset_seconds": float,
+    "timeout": float,
+}
+
+
+class UpstreamUnavailableError(aiohttp.ClientError):
+    """Raised instead of sending a request that the host's policy won't allow right now.
+
+    Subclasses aiohttp.ClientError so existing request error handling covers it.
+    """
+
+
+def parse_retry_after(value):
+    """Returns the delay in seconds from a Retry-After header (seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available."""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    async def acquire(self, max_wait):
+        """Takes a token, waiting for one if needed. Returns False if that would take longer than max_wait."""
+        while True:
+            wait = self.wait_time()
+            if wait <= 0:
+                self._tokens -= 1
+                return True
+            if wait > max_wait:
+                return False
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """Fails fast while an upstream is unhealthy.
+
+    After `failure_threshold` failed calls in a row the circuit opens and
+    calls are rejected for `reset_seconds`. A failure can also force the
+    circuit open for a given time (an upstream Retry-After too long to wait
+    out). Then a single trial call is let through: success closes the
+    circuit, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self._open_until = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        if self._open_until is None:
+            return self.CLOSED
+        return self.OPEN if time.monotonic() < self._open_until else self.HALF_OPEN
+
+    def retry_in(self):
+        """Seconds until an open circuit lets a trial call through."""
+        if self._open_until is None:
+            return 0.0
+        return max(0.0, self._open_until - time.monotonic())
+
+    def allow(self):
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._open_until = None
+        self._trial_running = False
+
+    def record_failure(self, open_for=None):
+        """Counts a failed call. `open_for` opens the circuit for that many seconds regardless of the count."""
+        self.failures += 1
+        half_open = self._trial_running
+        self._trial_running = False
+        if open_for:
+            self._open_until = time.monotonic() + open_for
+        elif half_open or self.failures >= self.failure_threshold:
+            self._open_until = time.monotonic() + self.reset_seconds
+
+    def release_trial(self):
+        """Gives up a trial slot without a verdict (e.g. the caller was cancelled)."""
+        self._trial_running = False
+
+
+class HostPolicy:
+    """Rate limit, concurrency cap, retries and circuit breaker for one upstream host."""
+
+    def __init__(self, host, rate, burst, max_concurrency, max_retries, max_wait,
+                 failure_threshold, reset_seconds, timeout):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.rejected = 0
+        self.failed = 0
+
+    async def acquire(self):
+        """Waits for permission to send a request, or raises UpstreamUnavailableError."""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise UpstreamUnavailableError(f"{self.host} is unavailable (circuit open for another {self.breaker.retry_in():.0f}s)")
+        try:
+            if self.bucket is not None and not await self.bucket.acquire(self.max_wait):
+                self.rejected += 1
+                raise UpstreamUnavailableError(f"{self.host} is rate limited, try again later")
+            await asyncio.wait_for(self._slots.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self.breaker.release_trial()
+            self.rejected += 1
+            raise UpstreamUnavailableError(f"{self.host} is busy, try again later")
+        except BaseException:
+            self.breaker.release_trial()
+            raise
+        self.in_flight += 1
+        self.calls += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def _backoff(self, attempt, retry_after):
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 0.5)
+        # Full jitter: anywhere up to an exponentially growing cap.
+        return random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+
+    async def send(self, session, method, url, kwargs):
+        """Sends a request, retrying failures with jittered backoff. Returns the final response."""
+        try:
+            return await self._send_with_retries(session, method, url, kwargs)
+        except BaseException:
+            # Cancellation (e.g. during a backoff sleep) or an unexpected error ends the
+            # call without a verdict; a half-open breaker must not keep waiting on it.
+            self.breaker.release_trial()
+            raise
+
+    async def _send_with_retries(self, session, method, url, kwargs):
+        if self.timeout is not None and "timeout" not in kwargs:
+            # Only the total changes; the session's connect timeout still applies.
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=self.timeout, connect=session.timeout.connect)
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = await session.request(method, url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.max_retries:
+                    self._record_failure()
+                    raise
+            else:
+                if response.status not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if attempt >= self.max_retries or (retry_after or 0) > self.max_wait:
+                    # A Retry-After longer than we'd wait holds the circuit open that long;
+                    # a short one is just another failure toward the threshold.
+                    self._record_failure(retry_after if (retry_after or 0) > self.max_wait else None)
+                    return response
+                response.release()
+
+            delay = self._backoff(attempt, retry_after)
+            attempt += 1
+            self.retries += 1
+            logging.info(f"[Upstream] Retrying {self.host} in {delay:.1f}s (attempt {attempt + 1} of {self.max_retries + 1}).")
+            await asyncio.sleep(delay)
+
+    def _record_failure(self, open_for=None):
+        was_closed = self.breaker.state == CircuitBreaker.CLOSED
+        self.failed += 1
+        self.breaker.record_failure(open_for)
+        if was_closed and self.breaker.state == CircuitBreaker.OPEN:
+            logging.warning(f"[Upstream] Circuit for {self.host} opened for {self.breaker.retry_in():.0f}s after {self.breaker.failures} failure(s).")
+
+    def stats(self):
+        return {
+            "host": self.host,
+            "state": self.breaker.state,
+            "retry_in": round(self.breaker.retry_in(), 1),
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+class UpstreamPolicies:
+    """Creates a HostPolicy per host on first use, from DEFAULT_POLICY, HOST_POLICIES and any overrides."""
+
+    def __init__(self, defaults=None, overrides=None):
+        self.defaults = {**DEFAULT_POLICY, **(defaults or {})}
+        self.overrides = overrides or {}  # {host: {setting: value}}
+        self._policies = {}
+
+    def for_host(self, host):
+        policy = self._policies.get(host)
+        if policy is None:
+            settings = {**self.defaults, **HOST_POLICIES.get(host, {}), **self.overrides.get(host, {})}
+            settings = {key: POLICY_TYPES[key](value) if value is not None else None
+                    for key, value in settings.items() if key in POLICY_TYPES}
+            policy = self._policies[host] = HostPolicy(host, **settings)
+        return policy
+
+    def stats(self):
+        return [policy.stats() for policy in self._policies.values()]
+
+
+class GuardedRequest:
+    """Async context manager that sends a request under its host's policy.
+
+    The concurrency slot is held until the response is released, so the
+    body is read inside the cap as well.
+    """
+
+    def __init__(self, policy, session, method, url, kwargs):
+        self._policy = policy
+        self._session = session
+        self._method = method
+        self._url = url
+        self._kwargs = kwargs
+        self._response = None
+
+    async def __aenter__(self):
+        await self._policy.acquire()
+        try:
+            self._response = await self._policy.send(self._session, self._method, self._url, self._kwargs)
+        except BaseException:
+            self._policy.release()
+            raise
+        return self._response
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._response.release()
+        self._policy.release()